@@ -1,13 +1,29 @@
-from .compute_cost import compute_cost, compute_cost_ours
+from .compute_cost import (compute_cost, compute_cost_ours,
+                           compute_cost_exact, compute_cost_stream,
+                           compute_cost_parallel, CostEngine)
 from .utils import check_keyboard, compute_cell_location
-from .draw_keyboard import draw
-from ._concat_logs import concat_results
 
 __all__ = [
     'compute_cost',
     'compute_cost_ours',
+    'compute_cost_exact',
+    'compute_cost_stream',
+    'compute_cost_parallel',
+    'CostEngine',
     'check_keyboard',
     'compute_cell_location',
     'draw',
     'concat_results'
 ]
+
+
+def __getattr__(name):
+    # drawing and log consolidation pull in opencv, matplotlib and pandas, so
+    # they are only imported when used
+    if name == 'draw':
+        from .draw_keyboard import draw
+        return draw
+    if name == 'concat_results':
+        from ._concat_logs import concat_results
+        return concat_results
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,120 @@
+"""
+Script that compiles a text corpus into an integer coded array, stored as a
+uint8 .npy file next to the text file together with its unigram/bigram tables,
+so the cost functions can memory-map the corpus instead of reading a string
+"""
+
+import argparse
+import os
+import numpy as np
+
+from .compute_cost import encode_corpus, compute_bigrams
+
+CHUNK_SIZE = 2 ** 24
+
+
+def compiled_paths(corpus_path):
+    """Paths of the compiled corpus and of its tables"""
+
+    root, _ = os.path.splitext(corpus_path)
+    return root + '.npy', root + '.tables.npz'
+
+
+def read_chunks(corpus_path, chunk_size=CHUNK_SIZE):
+    """Reads a text corpus in chunks of chunk_size characters, without the
+    final newline"""
+
+    with open(corpus_path, 'r') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            following = f.read(chunk_size)
+            if not following and chunk.endswith('\n'):
+                chunk = chunk[:-1]
+            if chunk:
+                yield chunk
+            chunk = following
+
+
+def compile_corpus(corpus_path, valid_keys, chunk_size=CHUNK_SIZE):
+    """Encodes the corpus with the index of each character in valid_keys and
+    stores it, along with its unigram and bigram counts"""
+
+    codes_path, tables_path = compiled_paths(corpus_path)
+    n_keys = len(valid_keys)
+
+    length = sum(len(chunk) for chunk in read_chunks(corpus_path, chunk_size))
+    codes = np.lib.format.open_memmap(codes_path, mode='w+',
+                                      dtype=np.uint8, shape=(length,))
+
+    bigrams = np.zeros((n_keys + 1, n_keys + 1), dtype=np.int64)
+    last = n_keys
+    done = 0
+    for chunk in read_chunks(corpus_path, chunk_size):
+        chunk_codes = encode_corpus(chunk, valid_keys)
+        codes[done:done + len(chunk_codes)] = chunk_codes
+        done += len(chunk_codes)
+
+        bigrams += compute_bigrams(chunk_codes, n_keys)
+        bigrams[n_keys, chunk_codes[0]] -= 1
+        bigrams[last, chunk_codes[0]] += 1
+        last = chunk_codes[-1]
+
+    codes.flush()
+    del codes
+
+    stat = os.stat(corpus_path)
+    np.savez(tables_path, valid_keys=valid_keys, unigrams=bigrams.sum(axis=0),
+             bigrams=bigrams, source_size=stat.st_size,
+             source_mtime=stat.st_mtime)
+
+
+def load_corpus(corpus_path, valid_keys):
+    """Memory-maps the compiled corpus (compiling it first if it doesn't exist
+    or is outdated) and returns it with its tables"""
+
+    codes_path, tables_path = compiled_paths(corpus_path)
+    stat = os.stat(corpus_path)
+
+    tables = None
+    if os.path.exists(codes_path) and os.path.exists(tables_path):
+        with np.load(tables_path) as f:
+            tables = dict(f)
+        if (str(tables['valid_keys']) != valid_keys
+                or tables['source_size'] != stat.st_size
+                or tables['source_mtime'] != stat.st_mtime):
+            tables = None
+
+    if tables is None:
+        compile_corpus(corpus_path, valid_keys)
+        with np.load(tables_path) as f:
+            tables = dict(f)
+
+    return np.load(codes_path, mmap_mode='r'), tables
+
+
+def get_args():
+    """
+    Parse the arguments from the terminal
+    """
+
+    descr = 'Compile a corpus into an integer coded array.'
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument('--corpus', metavar='C', type=str,
+                        default='data/en-corpus.txt',
+                        help='Corpus to compile')
+    parser.add_argument('--valid-keys', metavar='V', type=str,
+                        default='data/en-keys.txt',
+                        help='Filename with the valid keys')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    ARGS = get_args()
+
+    with open(ARGS.valid_keys, 'r') as f:
+        VALID_CHARS = f.read()[:-1]
+
+    compile_corpus(ARGS.corpus, VALID_CHARS)
+    print('Compiled:', *compiled_paths(ARGS.corpus))
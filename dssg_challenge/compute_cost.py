@@ -4,20 +4,51 @@ corpus
 """
 
 import argparse
+import hashlib
 import heapq
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 import numpy as np
-from sklearn.metrics import pairwise_distances
 
-from .utils import check_keyboard, compute_cell_location
+from .utils import check_keyboard, compute_cell_location, \
+    compute_distance_matrix
 
 
-# Initialize the variables
-COORDS = compute_cell_location()
+# Virtual cells used by the exact cost: PAD_CELL pads the list of cells of a
+# key and can't be reached, END_CELL follows the last character for free
+KEYBOARD_SIZE = 37
+PAD_CELL = KEYBOARD_SIZE
+END_CELL = PAD_CELL + 1
 
-dist_matrix = pairwise_distances(COORDS, n_jobs=-1)
+
+@lru_cache(maxsize=None)
+def compute_ext_distance_matrix(size=KEYBOARD_SIZE):
+    """Distance matrix extended with the PAD_CELL and END_CELL rows/columns"""
+
+    ext_dist = np.full((size + 2, size + 2), np.inf)
+    ext_dist[:size, :size] = compute_distance_matrix(size)
+    ext_dist[:size, size + 1] = 0
+    ext_dist.flags.writeable = False
+
+    return ext_dist
+
+
+def __getattr__(name):
+    # the keyboard geometry is only computed when first needed
+    if name == 'COORDS':
+        return compute_cell_location()
+    if name == 'dist_matrix':
+        return compute_distance_matrix()
+    if name == 'ext_dist_matrix':
+        return compute_ext_distance_matrix()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 def compute_cost_ours(keyboard, corpus):
     rg = range(1, len(corpus))
+    dist_matrix = compute_distance_matrix()
 
 
     mapping = {k: [] for k in set(keyboard)
@@ -78,12 +109,22 @@ def get_args():
     parser.add_argument('--keyboard', metavar='K', type=str,
                         required=True,
                         help='Keyboard assignment')
+    parser.add_argument('--stream', action='store_true',
+                        help='Compute the exact cost reading the corpus in '
+                             'chunks, in constant memory')
+    parser.add_argument('--chunk-size', metavar='S', type=int,
+                        default=2 ** 24,
+                        help='Characters per chunk with --stream')
+    parser.add_argument('--workers', metavar='W', type=int, default=0,
+                        help='Compute the exact cost of the compiled corpus '
+                             'in W processes (0 to disable)')
 
     return parser.parse_args()
 
 def compute_cost(keyboard, corpus):
     """Computes the cost of using a keyboard for a certain corpus"""
 
+    dist_matrix = compute_distance_matrix()
     mapping = {k: [] for k in set(keyboard)
                if k != ''}
 
@@ -121,6 +162,530 @@ def compute_cost(keyboard, corpus):
     return np.inf
 
 
+def encode_corpus(corpus, valid_keys):
+    """Encodes the corpus as an array with the index of each character in
+    valid_keys"""
+
+    chars = np.frombuffer(corpus.encode('utf-32-le'), dtype=np.uint32)
+    keys = np.frombuffer(valid_keys.encode('utf-32-le'), dtype=np.uint32)
+
+    order = np.argsort(keys)
+    found = np.searchsorted(keys, chars, sorter=order)
+    codes = order[np.minimum(found, len(keys) - 1)]
+
+    unknown = keys[codes] != chars
+    if unknown.any():
+        raise ValueError("Character in corpus not in valid_keys: '%s'"
+                         % corpus[np.argmax(unknown)])
+
+    return codes.astype(np.uint8)
+
+
+def compute_bigrams(codes, n_keys):
+    """Counts the transitions between keys when typing an encoded corpus.
+
+    Row/column ``n_keys`` is the start token, i.e. the cursor resting on the
+    central cell before the first character is typed.
+    """
+
+    size = n_keys + 1
+    codes = np.asarray(codes, dtype=np.intp)
+
+    bigrams = np.bincount(codes[:-1] * size + codes[1:],
+                          minlength=size * size).reshape(size, size)
+    if len(codes):
+        bigrams[n_keys, codes[0]] += 1
+
+    return bigrams
+
+
+def layout_slots(layout, n_keys):
+    """Table with the cells holding each key of an integer coded layout
+    (codes >= n_keys are blank cells), padded with PAD_CELL.
+
+    Rows ``n_keys`` and ``n_keys + 1`` are the start token (central cell) and
+    the end token (END_CELL).
+    """
+
+    cells = [[] for _ in range(n_keys)]
+    for pos, key in enumerate(layout):
+        if key < n_keys:
+            cells[key].append(pos)
+
+    width = max([1] + [len(key_cells) for key_cells in cells])
+    slots = np.full((n_keys + 2, width), PAD_CELL)
+    for key, key_cells in enumerate(cells):
+        slots[key, :len(key_cells)] = key_cells
+    slots[n_keys, 0] = 0
+    slots[n_keys + 1, 0] = END_CELL
+
+    return slots
+
+
+def bigrams_cost(bigrams, slots):
+    """Computes the cost of the transitions between keys with a single cell
+    (the remaining transitions are left to runs_cost)"""
+
+    single = np.flatnonzero((slots[:len(bigrams)] != PAD_CELL).sum(1) == 1)
+    pos = slots[single, 0]
+
+    return (bigrams[np.ix_(single, single)]
+            * compute_distance_matrix()[np.ix_(pos, pos)]).sum()
+
+
+def compute_runs(codes, multi, start, end):
+    """Groups the runs of consecutive keys that have more than one cell.
+
+    Returns a list with one ``(runs, counts)`` pair per run length, where each
+    row of ``runs`` holds the key typed before the run, the keys in the run
+    and the key typed after it (``start``/``end`` at the corpus boundaries),
+    and ``counts`` how many times that run occurs in the corpus.
+    """
+
+    n_codes = len(codes)
+    is_multi = np.asarray(multi)[codes]
+    edges = np.diff(np.concatenate(([0], is_multi, [0])).astype(np.int8))
+    run_starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - run_starts
+
+    groups = []
+    for length in np.unique(lengths):
+        index = run_starts[lengths == length, None] + np.arange(-1, length + 1)
+        runs = np.asarray(codes[np.clip(index, 0, n_codes - 1)], dtype=np.intp)
+        runs[index < 0] = start
+        runs[index >= n_codes] = end
+
+        # sorting one integer per run is much faster than unique rows
+        width = length + 2
+        if width * np.log2(end + 1) < 63:
+            ids = runs @ (end + 1) ** np.arange(width, dtype=np.int64)
+            _, first, counts = np.unique(ids, return_index=True,
+                                         return_counts=True)
+            groups.append((runs[first], counts))
+        else:
+            groups.append(np.unique(runs, axis=0, return_counts=True))
+
+    return groups
+
+
+def runs_cost(groups, slots):
+    """Computes the exact cost of typing the runs of keys with several cells.
+
+    Runs are bounded by keys with a single cell, so each one is solved
+    independently by dynamic programming over the cells of its keys, keeping
+    one cost vector per distinct run.
+    """
+
+    ext_dist_matrix = compute_ext_distance_matrix()
+
+    total = 0.
+    for runs, counts in groups:
+        cells = slots[runs]
+        cost = ext_dist_matrix[cells[:, 0, :1], cells[:, 1]]
+
+        for i in range(2, runs.shape[1]):
+            step = ext_dist_matrix[cells[:, i - 1, :, None],
+                                   cells[:, i, None, :]]
+            cost = (cost[:, :, None] + step).min(axis=1)
+
+        total += counts @ cost[:, 0]
+
+    return total
+
+
+class CostEngine:
+    """Computes the cost of keyboard layouts for a fixed corpus.
+
+    The corpus is reduced once to a bigram count matrix, so scoring a layout
+    without duplicate keys costs a gather plus a dot product, regardless of
+    the length of the corpus. Layouts with duplicate keys get the exact
+    (minimum over the cells of each key) cost: transitions between keys with
+    a single cell still come from the bigram counts, and the runs of keys
+    with several cells are solved by dynamic programming.
+    """
+
+    def __init__(self, corpus, valid_keys, bigrams=None, max_cached_runs=1024):
+        self.valid_keys = valid_keys
+        self.start = len(valid_keys)
+        self.end = self.start + 1
+
+        # the corpus can also be given already encoded (see encode_corpus)
+        if isinstance(corpus, str):
+            self.codes = encode_corpus(corpus, valid_keys)
+        else:
+            self.codes = corpus
+
+        if bigrams is None:
+            bigrams = compute_bigrams(self.codes, self.start)
+        self.bigrams = np.asarray(bigrams)
+        self.unigrams = self.bigrams.sum(axis=0)
+
+        self._key_index = {k: i for i, k in enumerate(valid_keys)}
+        self._runs = OrderedDict()
+        self._max_cached_runs = max_cached_runs
+        self._samples = OrderedDict()
+        self._fingerprint = None
+
+    @classmethod
+    def from_file(cls, corpus_path, valid_keys, **kwargs):
+        """Creates the engine from the compiled (memory-mapped) corpus, see
+        compile_corpus"""
+
+        from .compile_corpus import load_corpus
+
+        codes, tables = load_corpus(corpus_path, valid_keys)
+        return cls(codes, valid_keys, bigrams=tables['bigrams'], **kwargs)
+
+    @property
+    def fingerprint(self):
+        """Digest of the valid keys and of the encoded corpus, identifying
+        the costs computed by this engine"""
+
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(self.valid_keys.encode(), digest_size=16)
+            codes = np.asarray(self.codes, dtype=np.uint8)
+            for first in range(0, len(codes), 2 ** 24):
+                digest.update(np.ascontiguousarray(codes[first:first + 2 ** 24]))
+            self._fingerprint = digest.hexdigest()
+
+        return self._fingerprint
+
+    def encode_layout(self, keyboard):
+        """Integer codes of the keys of a keyboard (len(valid_keys) for blank
+        cells)"""
+
+        return np.array([self._key_index.get(char, self.start)
+                         for char in keyboard], dtype=np.uint8)
+
+    def slots(self, keyboard):
+        """Table with the cells holding each valid key, see layout_slots"""
+
+        return layout_slots(self.encode_layout(keyboard), self.start)
+
+    def runs(self, multi):
+        """Runs of the corpus over the keys flagged in multi (cached)"""
+
+        key = multi.tobytes()
+        if key in self._runs:
+            self._runs.move_to_end(key)
+        else:
+            self._runs[key] = compute_runs(self.codes, multi,
+                                           self.start, self.end)
+            if len(self._runs) > self._max_cached_runs:
+                self._runs.popitem(last=False)
+
+        return self._runs[key]
+
+    def cost(self, keyboard):
+        """Computes the cost of using a keyboard for the corpus"""
+
+        return self._cost(self.encode_layout(keyboard))
+
+    def _cost(self, layout):
+        slots = layout_slots(layout, self.start)
+        n_slots = (slots[:self.end] != PAD_CELL).sum(axis=1)
+
+        if ((n_slots == 0) & (self.unigrams > 0)).any():
+            return np.inf
+
+        cost = bigrams_cost(self.bigrams, slots)
+
+        multi = n_slots[:self.start] > 1
+        if multi.any():
+            cost += runs_cost(self.runs(multi), slots)
+
+        return float(cost)
+
+    def batch_cost(self, layouts, batch_size=1024):
+        """Computes the cost of each row of a matrix of integer coded layouts
+        (see encode_layout).
+
+        Layouts without duplicate keys are scored together, as a gather of
+        the distance matrix contracted with the bigram counts; the remaining
+        ones get the exact cost one by one.
+        """
+
+        layouts = np.asarray(layouts, dtype=np.intp)
+        n_layouts, n_cells = layouts.shape
+        keys = np.minimum(layouts, self.start)
+
+        rows = np.arange(n_layouts)[:, None]
+        counts = np.zeros((n_layouts, self.end), dtype=np.intp)
+        np.add.at(counts, (rows, keys), 1)
+        counts = counts[:, :self.start]
+
+        costs = np.full(n_layouts, np.inf)
+        missing = ((counts == 0) & (self.unigrams[:self.start] > 0)).any(1)
+        single = ~missing & (counts <= 1).all(axis=1)
+
+        # cell of each key (blanks are written to the start token column and
+        # then overwritten, as the cursor starts in the central cell)
+        pos = np.zeros((n_layouts, self.end), dtype=np.intp)
+        pos[rows, keys] = np.arange(n_cells)
+        pos[:, self.start] = 0
+
+        dist_matrix = compute_distance_matrix()
+        index = np.flatnonzero(single)
+        for first in range(0, len(index), batch_size):
+            batch = index[first:first + batch_size]
+            dists = dist_matrix[pos[batch, :, None], pos[batch, None, :]]
+            costs[batch] = np.einsum('nab,ab->n', dists, self.bigrams)
+
+        for n in np.flatnonzero(~missing & ~single):
+            costs[n] = self._cost(layouts[n])
+
+        return costs
+
+    def lower_bound(self, keyboard):
+        """Lower bound of the cost of using a keyboard for the corpus, see
+        batch_lower_bound"""
+
+        return float(self.batch_lower_bound(
+            self.encode_layout(keyboard)[None])[0])
+
+    def batch_lower_bound(self, layouts, batch_size=1024):
+        """Computes a lower bound of the cost of each row of a matrix of
+        integer coded layouts from the bigram counts alone, taking for each
+        pair of keys the shortest distance between any of their cells.
+
+        The bound is the exact cost for layouts without duplicate keys, so
+        those are scored as in batch_cost.
+        """
+
+        layouts = np.asarray(layouts, dtype=np.intp)
+
+        counts = np.zeros((len(layouts), self.end), dtype=np.intp)
+        np.add.at(counts, (np.arange(len(layouts))[:, None],
+                           np.minimum(layouts, self.start)), 1)
+        counts = counts[:, :self.start]
+        missing = ((counts == 0) & (self.unigrams[:self.start] > 0)).any(1)
+        single = ~missing & (counts <= 1).all(axis=1)
+
+        costs = np.full(len(layouts), np.inf)
+        costs[single] = self.batch_cost(layouts[single], batch_size)
+
+        ext_dist_matrix = compute_ext_distance_matrix()
+        size = self.start + 1
+        for n in np.flatnonzero(~missing & ~single):
+            slots = layout_slots(layouts[n], self.start)[:size]
+            closest = ext_dist_matrix[slots[:, :, None, None],
+                                      slots[None, None, :, :]].min((1, 3))
+            closest[self.bigrams == 0] = 0
+            costs[n] = (self.bigrams * closest).sum()
+
+        return costs
+
+    def sample_windows(self, sample_size, window_size=64, seed=None):
+        """Stratified random sample of windows of the corpus (cached).
+
+        The corpus is split into sample_size // 2 contiguous strata and two
+        windows are drawn in each one, so the variance within each stratum can
+        be estimated. Each row of the returned ``windows`` holds the key typed
+        before the window followed by the window_size keys typed in it.
+        """
+
+        key = (sample_size, window_size, seed)
+        if key in self._samples:
+            self._samples.move_to_end(key)
+            return self._samples[key]
+
+        n_codes = len(self.codes)
+        window_size = max(1, min(window_size, n_codes))
+        n_strata = max(1, min(sample_size // 2, n_codes // window_size))
+        bounds = np.linspace(0, n_codes, n_strata + 1).astype(np.intp)
+
+        rng = np.random.default_rng(seed)
+        lengths = np.diff(bounds)
+        offsets = rng.integers(0, lengths - window_size + 1,
+                               size=(2, n_strata)).T
+        starts = (bounds[:-1, None] + offsets).ravel()
+
+        index = starts[:, None] + np.arange(-1, window_size)
+        windows = np.asarray(self.codes[np.maximum(index, 0)], dtype=np.intp)
+        windows[index < 0] = self.start
+
+        sample = {
+            "windows": windows,
+            "lengths": lengths,
+            "window_size": window_size
+        }
+        self._samples[key] = sample
+        if len(self._samples) > 8:
+            self._samples.popitem(last=False)
+
+        return sample
+
+    def estimate(self, keyboard, sample_size, window_size=64, seed=None):
+        """Estimates the cost of using a keyboard for the corpus from a
+        stratified sample of windows (see sample_windows).
+
+        Returns the estimate and its standard error. Windows start from the
+        best cell of the key typed before them, so for keyboards with
+        duplicate keys the estimate is very slightly optimistic.
+        """
+
+        sample = self.sample_windows(sample_size, window_size, seed)
+        return self._estimate(self.encode_layout(keyboard), sample)
+
+    def _estimate(self, layout, sample):
+        slots = layout_slots(layout, self.start)
+        cells = slots[sample["windows"]]
+        ext_dist_matrix = compute_ext_distance_matrix()
+
+        if (cells[:, :, 0] == PAD_CELL).any():
+            return np.inf, 0.
+
+        state = np.where(cells[:, 0] == PAD_CELL, np.inf, 0.)
+        for i in range(1, cells.shape[1]):
+            step = ext_dist_matrix[cells[:, i - 1, :, None],
+                                   cells[:, i, None, :]]
+            state = (state[:, :, None] + step).min(axis=1)
+
+        # cost per character in each window, two windows per stratum
+        rates = state.min(axis=1).reshape(-1, 2) / sample["window_size"]
+        lengths = sample["lengths"]
+
+        estimate = lengths @ rates.mean(axis=1)
+        variance = (lengths ** 2) @ (rates.var(axis=1, ddof=1) / 2)
+
+        return float(estimate), float(np.sqrt(variance))
+
+
+def compute_cost_exact(keyboard, corpus):
+    """Computes the exact cost of using a keyboard for a certain corpus,
+    always typing each character from the cell that minimizes the total
+    distance"""
+
+    valid_keys = ''.join(sorted(set(keyboard) - {'', '_'}))
+    try:
+        return CostEngine(corpus, valid_keys).cost(keyboard)
+    except ValueError:
+        return np.inf
+
+
+def _stream_cost(layout, valid_keys, chunks, last=None):
+    """Exact cost of typing the chunks with an integer coded layout, starting
+    from the key last (the start token by default)"""
+
+    n_keys = len(valid_keys)
+    slots = layout_slots(layout, n_keys)
+    n_slots = (slots != PAD_CELL).sum(axis=1)
+    multi = n_slots[:n_keys] > 1
+    ext_dist_matrix = compute_ext_distance_matrix()
+
+    def _viterbi(last, state, codes):
+        for code in codes:
+            state = (state[:, None] + ext_dist_matrix[
+                slots[last][:, None], slots[code][None, :]]).min(axis=0)
+            last = code
+        return state
+
+    def _state(last, cost):
+        return np.where(slots[last] == PAD_CELL, np.inf, cost)
+
+    if last is None:
+        last = n_keys
+    state = _state(last, 0.)
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = encode_corpus(chunk, valid_keys)
+        if len(chunk) == 0:
+            continue
+        if (n_slots[chunk] == 0).any():
+            return np.inf
+
+        anchors = np.flatnonzero(~multi[chunk])
+        if len(anchors) == 0:
+            state = _viterbi(last, state, chunk)
+            last = chunk[-1]
+            continue
+
+        # up to the first key with a single cell
+        first, final = anchors[0], anchors[-1]
+        cost = _viterbi(last, state, chunk[:first + 1])[0]
+
+        # closed segment between keys with a single cell
+        segment = chunk[first:final + 1]
+        bigrams = compute_bigrams(segment, n_keys)
+        bigrams[n_keys, segment[0]] -= 1
+        cost += bigrams_cost(bigrams, slots)
+        cost += runs_cost(compute_runs(segment, multi, n_keys, n_keys + 1),
+                          slots)
+
+        # after the last key with a single cell
+        state = _viterbi(segment[-1], _state(segment[-1], cost),
+                         chunk[final + 1:])
+        last = chunk[-1]
+
+    return float(state.min())
+
+
+def _encode_keyboard(keyboard, valid_keys):
+    key_index = {k: i for i, k in enumerate(valid_keys)}
+    return np.array([key_index.get(char, len(valid_keys))
+                     for char in keyboard], dtype=np.uint8)
+
+
+def compute_cost_stream(keyboard, chunks, valid_keys):
+    """Computes the exact cost of using a keyboard for a corpus given in
+    chunks (strings or encoded arrays, e.g. from compile_corpus.read_chunks),
+    so the corpus never has to fit in memory.
+
+    Each chunk is scored like CostEngine.cost, except for its first and last
+    runs of keys with several cells, which are solved step by step. The
+    dynamic programming state (cost of ending in each cell of the last key)
+    is carried over to the next chunk, so the result doesn't depend on where
+    the corpus is split.
+    """
+
+    return _stream_cost(_encode_keyboard(keyboard, valid_keys), valid_keys,
+                        chunks)
+
+
+def compute_cost_parallel(keyboard, corpus, valid_keys, n_workers=None):
+    """Computes the exact cost of using a keyboard for a corpus (a string or
+    an encoded array, e.g. a memory-mapped compiled corpus), scoring shards
+    of the corpus in a pool of n_workers processes (one per CPU by default).
+
+    The shards are cut right after a key with a single cell, where the
+    cursor position is known, so the cost of each shard doesn't depend on
+    the others and their sum is the exact cost of the whole corpus.
+    """
+
+    if isinstance(corpus, str):
+        corpus = encode_corpus(corpus, valid_keys)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    n_keys = len(valid_keys)
+    layout = _encode_keyboard(keyboard, valid_keys)
+    counts = np.bincount(layout, minlength=n_keys + 1)[:n_keys]
+
+    # cut points: the first single cell key after each equally spaced mark
+    anchors = np.flatnonzero(counts[corpus] == 1)
+    marks = np.arange(1, n_workers) * len(corpus) // n_workers
+    cuts = anchors
+    if len(anchors):
+        next_anchor = np.searchsorted(anchors, marks)
+        cuts = np.unique(anchors[np.minimum(next_anchor, len(anchors) - 1)])
+
+    bounds = np.concatenate(([-1], cuts, [len(corpus) - 1]))
+    shards = [(corpus[start + 1:stop + 1],
+               corpus[start] if start >= 0 else None)
+              for start, stop in zip(bounds[:-1], bounds[1:])
+              if stop > start]
+
+    if len(shards) <= 1 or n_workers <= 1:
+        return _stream_cost(layout, valid_keys, [corpus])
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        costs = pool.map(_stream_cost, repeat(layout), repeat(valid_keys),
+                         ([shard] for shard, _ in shards),
+                         (last for _, last in shards))
+        return float(sum(costs))
+
+
 if __name__ == '__main__':
 
     ARGS = get_args()
@@ -128,10 +693,6 @@ if __name__ == '__main__':
     with open(ARGS.valid_keys, 'r') as f:
         VALID_CHARS = f.read()[:-1]
 
-    # Get the corpus
-    with open(ARGS.corpus, 'r') as f:
-        CORPUS = f.read().strip()
-
     # Read the assigment
     ASSIGNMENT = ARGS.keyboard
     ASSIGNMENT = [k if k != '_' else "" for k in ASSIGNMENT]
@@ -139,5 +700,21 @@ if __name__ == '__main__':
     # Validate the keyboard
     check_keyboard(ASSIGNMENT, VALID_CHARS)
 
-    # Compute cost
-    print('Cost:', compute_cost(ASSIGNMENT, CORPUS))
+    if ARGS.stream:
+        from .compile_corpus import read_chunks
+
+        CHUNKS = read_chunks(ARGS.corpus, ARGS.chunk_size)
+        print('Cost:', compute_cost_stream(ASSIGNMENT, CHUNKS, VALID_CHARS))
+    elif ARGS.workers:
+        from .compile_corpus import load_corpus
+
+        CODES, _ = load_corpus(ARGS.corpus, VALID_CHARS)
+        print('Cost:', compute_cost_parallel(ASSIGNMENT, CODES, VALID_CHARS,
+                                             ARGS.workers))
+    else:
+        # Get the corpus
+        with open(ARGS.corpus, 'r') as f:
+            CORPUS = f.read().strip()
+
+        # Compute cost
+        print('Cost:', compute_cost(ASSIGNMENT, CORPUS))
@@ -5,6 +5,7 @@ import math
 import heapq
 
 from dssg_challenge.ga.problem.objective import ProblemObjective
+from dssg_challenge.ga.problem.fidelity import FitnessFidelity
 from dssg_challenge.ga.problem.solution import EncodingDataType, LinearSolution
 from dssg_challenge.ga.problem.population import Population
 
@@ -39,10 +40,11 @@ def initialize_using_random(problem, population_size):
 
         s.id = [0, i]
 
-        problem.evaluate_solution(s)
-
         solution_list.append(s)
 
+    # evaluate the whole initial population at once
+    problem.evaluate_solutions(solution_list)
+
     population = Population(
         problem = problem,
         maximum_size = population_size,
@@ -74,10 +76,11 @@ def initialize_using_heuristic(problem, population_size):
 
         s.id = [0, i]
 
-        problem.evaluate_solution(s)
-
         solution_list.append(s)
 
+    # evaluate the whole initial population at once
+    problem.evaluate_solutions(solution_list)
+
     population = Population(
         problem = problem,
         maximum_size = population_size,
@@ -109,10 +112,11 @@ def initialize_using_hc(problem, population_size):
 
         s.id = [0, i]
 
-        problem.evaluate_solution(s)
-
         solution_list.append(s)
 
+    # evaluate the whole initial population at once
+    problem.evaluate_solutions(solution_list)
+
     population = Population(
         problem = problem,
         maximum_size = population_size,
@@ -151,8 +155,6 @@ def initialize_using_multiple(problem, population_size):
             if problem.is_admissible(s):
                 s.id = [0, i]
 
-                problem.evaluate_solution(s)
-
                 solution_list.append(s)
 
                 i += 1
@@ -168,12 +170,13 @@ def initialize_using_multiple(problem, population_size):
             if problem.is_admissible(s):
                 s.id = [0, i]
 
-                problem.evaluate_solution(s)
-
                 solution_list.append(s)
 
                 i += 1
 
+    # evaluate the whole initial population at once
+    problem.evaluate_solutions(solution_list)
+
     population = Population(
         problem = problem,
         maximum_size = population_size,
@@ -182,6 +185,31 @@ def initialize_using_multiple(problem, population_size):
 
     return population
 
+# -------------------------------------------------------------------------------------------------
+# Initialization with distinct solutions
+# -------------------------------------------------------------------------------------------------
+def initialize_using_distinct_random(problem, population_size):
+    """
+    Initialize a population of solutions using the Random method, without equivalent solutions (see
+    ProblemTemplate.canonical_key)
+
+    Required:
+    @ problem - problem's build solution function knows how to create an individual in accordance with the encoding.
+    @ population_size - to define the size of the population to be returned.
+    """
+    return build_distinct_population(problem, population_size, method='Random')
+
+def initialize_using_distinct_heuristic(problem, population_size):
+    """
+    Initialize a population of solutions using the Heuristic method, without equivalent solutions (see
+    ProblemTemplate.canonical_key)
+
+    Required:
+    @ problem - problem's build solution function knows how to create an individual in accordance with the encoding.
+    @ population_size - to define the size of the population to be returned.
+    """
+    return build_distinct_population(problem, population_size, method='Heuristic')
+
 # -------------------------------------------------------------------------------------------------
 # Initialization using Simulated Annealing
 # -------------------------------------------------------------------------------------------------
@@ -207,10 +235,11 @@ def initialize_using_sa(problem, population_size):
 
         s.id = [0, i]
 
-        problem.evaluate_solution(s)
-
         solution_list.append(s)
 
+    # evaluate the whole initial population at once
+    problem.evaluate_solutions(solution_list)
+
     population = Population(
         problem=problem,
         maximum_size=population_size,
@@ -242,10 +271,11 @@ def initialize_using_greedy(problem, population_size):
 
         s.id = [0, i]
 
-        problem.evaluate_solution(s)
-
         solution_list.append(s)
 
+    # evaluate the whole initial population at once
+    problem.evaluate_solutions(solution_list)
+
     population = Population(
         problem=problem,
         maximum_size=population_size,
@@ -419,6 +449,151 @@ def tournament_selection(population, objective, params):
     return population.solutions[index1], population.solutions[index2]
 
 
+###################################################################################################
+# BATCHED SELECTION APPROACHES
+###################################################################################################
+# Batched selection functions receive the fitness vector of the population and draw the parents of n_pairs
+# crossovers at once. They return an (n_pairs, 2) array of solution indices, the two parents of each pair being
+# always different. Each selection function above gets its batched version as its `batch` attribute.
+# -------------------------------------------------------------------------------------------------
+# Roulette Wheel Batched Selection Function
+# -------------------------------------------------------------------------------------------------
+def roulettewheel_indices(fitness, objective, n_pairs, params):
+    """
+    Roulette wheel selection of n_pairs parent pairs, with the chances of roulettewheel_selection
+    """
+    return _spin_wheel(_roulette_weights(fitness, objective), n_pairs)
+
+
+# -------------------------------------------------------------------------------------------------
+# Rank Batched Selection Function
+# -------------------------------------------------------------------------------------------------
+def rank_indices(fitness, objective, n_pairs, params):
+    """
+    Rank selection of n_pairs parent pairs: the i-th least fit solution gets a slice of the wheel of size i (as
+    in rank_selection, but ranking the population with a single argsort instead of sorting it)
+    """
+    fitness = np.asarray(fitness, dtype=np.float64)
+
+    if objective == ProblemObjective.Maximization:
+        order = np.argsort(fitness, kind='stable')
+    elif objective == ProblemObjective.Minimization:
+        order = np.argsort(-fitness, kind='stable')
+    else:
+        print('The code does not handle multiobjective problems yet.')
+        exit(code=1)
+
+    weights = np.empty(len(fitness))
+    weights[order] = np.arange(1, len(fitness) + 1)
+
+    return _spin_wheel(weights, n_pairs)
+
+
+# -------------------------------------------------------------------------------------------------
+# Tournament Batched Selection Function
+# -------------------------------------------------------------------------------------------------
+def tournament_indices(fitness, objective, n_pairs, params):
+    """
+    Tournament selection of n_pairs parent pairs: all the contenders are drawn in a single random index matrix and
+    the winners are found with argmax/argmin. The contenders of the second tournament of each pair are drawn
+    without the winner of the first one.
+    """
+    tournament_size = 2
+    if "Tournament-Size" in params:
+        tournament_size = params["Tournament-Size"]
+
+    fitness = np.asarray(fitness, dtype=np.float64)
+    size = len(fitness)
+    if size < 2:
+        return np.zeros((n_pairs, 2), dtype=np.intp)
+
+    if objective == ProblemObjective.Maximization:
+        best = np.argmax
+    elif objective == ProblemObjective.Minimization:
+        best = np.argmin
+    else:
+        print('The code does not handle multiobjective problems yet.')
+        exit(code=1)
+
+    rows = np.arange(n_pairs)[:, None]
+
+    contenders = np.random.randint(0, size, size=(n_pairs, tournament_size))
+    index1 = contenders[rows[:, 0], best(fitness[contenders], axis=1)]
+
+    # draw from the population without index1, shifting the indices after it
+    contenders = np.random.randint(0, size - 1, size=(n_pairs, tournament_size))
+    contenders += contenders >= index1[:, None]
+    index2 = contenders[rows[:, 0], best(fitness[contenders], axis=1)]
+
+    return np.stack((index1, index2), axis=1)
+
+
+roulettewheel_selection.batch = roulettewheel_indices
+rank_selection.batch = rank_indices
+tournament_selection.batch = tournament_indices
+
+
+###################################################################################################
+# MATING POOL SELECTION APPROACHES
+###################################################################################################
+# Mating pool selection functions have the signature of the batched selection functions, and are used as the
+# Selection-Approach directly: they are marked with a true `mating_pool` attribute. They select the whole mating pool
+# in one pass, without rejection sampling: the pool (of 2 * n_pairs indices) is shuffled and split in halves, and its
+# i-th index is paired with its (n_pairs + i)-th, so the parents are paired at random whatever their fitness rank
+# (and a solution filling several places of the pool can be paired with itself).
+# -------------------------------------------------------------------------------------------------
+# Stochastic Universal Sampling Function
+# -------------------------------------------------------------------------------------------------
+def stochastic_universal_sampling(fitness, objective, n_pairs, params):
+    """
+    Stochastic universal sampling: a roulette wheel (with the chances of roulettewheel_selection) spun only once, with
+    2 * n_pairs equally spaced pointers. Each solution is selected either floor or ceil of its expected number of
+    times.
+    """
+    weights = _roulette_weights(fitness, objective)
+    stops = np.cumsum(weights)
+    spacing = stops[-1] / (2 * n_pairs)
+
+    pointers = (np.random.random() + np.arange(2 * n_pairs)) * spacing
+    pool = np.searchsorted(stops, pointers, side='right')
+    pool = np.minimum(pool, len(weights) - 1)
+
+    return _pair_mating_pool(pool)
+
+
+# -------------------------------------------------------------------------------------------------
+# Truncation Selection Function
+# -------------------------------------------------------------------------------------------------
+def truncation_selection(fitness, objective, n_pairs, params):
+    """
+    Truncation selection: the fittest Truncation-Proportion (default 0.5) of the population is selected, all of its
+    solutions filling the mating pool the same number of times (give or take one)
+    """
+    truncation_proportion = 0.5
+    if "Truncation-Proportion" in params:
+        truncation_proportion = params["Truncation-Proportion"]
+
+    fitness = np.asarray(fitness, dtype=np.float64)
+    size = len(fitness)
+    selected = min(size, max(2, int(round(truncation_proportion * size))))
+
+    if objective == ProblemObjective.Maximization:
+        fittest = np.argpartition(-fitness, selected - 1)[:selected]
+    elif objective == ProblemObjective.Minimization:
+        fittest = np.argpartition(fitness, selected - 1)[:selected]
+    else:
+        print('The code does not handle multiobjective problems yet.')
+        exit(code=1)
+
+    pool = np.resize(np.random.permutation(fittest), 2 * n_pairs)
+
+    return _pair_mating_pool(pool)
+
+
+stochastic_universal_sampling.mating_pool = True
+truncation_selection.mating_pool = True
+
+
 ###################################################################################################
 # CROSSOVER APPROACHES
 ###################################################################################################
@@ -429,8 +604,8 @@ def singlepoint_crossover(problem, solution1, solution2):
     singlepoint = randint(0, len(solution1.representation)-1)
     #print(f" >> singlepoint: {singlepoint}")
 
-    offspring1 = deepcopy(solution1) #solution1.clone()
-    offspring2 = deepcopy(solution2) #.clone()
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     for i in range(singlepoint, len(solution2.representation)):
         offspring1.representation[i] = solution2.representation[i]
@@ -443,8 +618,8 @@ def singlepoint_crossover(problem, solution1, solution2):
 # -------------------------------------------------------------------------------------------------
 def pmx_crossover(problem, solution1, solution2):
     # copy the parents to the children because we only need to change the middle part and the repeated elements
-    offspring1 = deepcopy(solution1)
-    offspring2 = deepcopy(solution2)
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     # choose the random crossover points - get two different and ordered indexes
     crosspoint1, crosspoint2 = get_two_diff_order_index(0, (len(solution1.representation) - 1))
@@ -465,7 +640,10 @@ def pmx_crossover(problem, solution1, solution2):
         if offspring2.representation[i] in offspring2.representation[crosspoint1:crosspoint2]:  # repeated elements
             repeated_index2.append(i)                                                           # solution 2
 
-
+    # REMARK: the repeated elements are replaced with the element of the opposite parent at the same position (or, if
+    # it is already in the child, at the position of that element in the parent, and so on), not following the mapping
+    # of the middle part as the textbook PMX of pmx_crossover_matrix (the batched version used by Batch-Mode) does, so
+    # the two can give different children
     for i in repeated_index1: # for each repeated element in offspring1
         # replace i if the element in i of the opposite solution is not in offspring1
         if solution2.representation[i] not in offspring1.representation:
@@ -505,8 +683,8 @@ def cycle_crossover(problem, solution1, solution2):
     cycle = 1   # number of cycles
 
     # only changes when the cycle is even (considering it starts at 1)
-    offspring1 = deepcopy(solution1)  # solution1.clone()
-    offspring2 = deepcopy(solution2)  # .clone()
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     index_visited = []  # list of visited indexes during the cycles
     idx = None
@@ -561,8 +739,8 @@ def cycle_crossover(problem, solution1, solution2):
 # -------------------------------------------------------------------------------------------------
 def order1_crossover(problem, solution1, solution2):
     # copy the parents to the children because we only need to change the middle part and the repeated elements
-    offspring1 = deepcopy(solution1)
-    offspring2 = deepcopy(solution2)
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     # get two different, ordered, indexes
     crosspoint1, crosspoint2 = get_two_diff_order_index(0, (len(solution1.representation) - 1))
@@ -598,8 +776,8 @@ def order1_crossover(problem, solution1, solution2):
 # Heuristic Crossover
 # -------------------------------------------------------------------------------------------------
 def heuristic_crossover(problem, solution1, solution2):
-    offspring1 = deepcopy(solution1)
-    offspring2 = deepcopy(solution2)
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     distances = problem.distances
 
@@ -690,8 +868,8 @@ def multiple_crossover(problem, solution1, solution2):
 # Single Arithmetic Crossover
 # -------------------------------------------------------------------------------------------------
 def single_arithmetic_crossover(problem, solution1, solution2):
-    offspring1 = deepcopy(solution1)
-    offspring2 = deepcopy(solution2)
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     crosspoint = randint(0, (len(solution1.representation)-1))
     alpha = uniform(0, 1)
@@ -713,8 +891,8 @@ def single_arithmetic_crossover(problem, solution1, solution2):
 # Simple Arithmetic Crossover
 # -------------------------------------------------------------------------------------------------
 def simple_arithmetic_crossover(problem, solution1, solution2):
-    offspring1 = deepcopy(solution1)
-    offspring2 = deepcopy(solution2)
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     crosspoint = randint(0, (len(solution1.representation)-1))
     alpha = uniform(0, 1)
@@ -735,8 +913,8 @@ def simple_arithmetic_crossover(problem, solution1, solution2):
 # Whole Arithmetic Crossover
 # -------------------------------------------------------------------------------------------------
 def whole_arithmetic_crossover(problem, solution1, solution2):
-    offspring1 = deepcopy(solution1)
-    offspring2 = deepcopy(solution2)
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     alpha = uniform(0, 1)
 
@@ -768,8 +946,8 @@ def multiple_arithmetic_crossover(problem, solution1, solution2):
 def pip_crossover(problem, solution1, solution2):
     singlepoint = randint(0, len(solution1.representation)-1)
 
-    offspring1 = deepcopy(solution1)
-    offspring2 = deepcopy(solution2)
+    offspring1 = solution1.clone()
+    offspring2 = solution2.clone()
 
     for i in range(singlepoint, len(solution2.representation)):
         offspring1.representation[i] = solution2.representation[i]
@@ -799,6 +977,100 @@ def pip_crossover(problem, solution1, solution2):
 
     return offspring1, offspring2
 
+
+###################################################################################################
+# BATCHED CROSSOVER APPROACHES
+###################################################################################################
+# Batched crossover functions cross the rows of two (M, size) genome matrices pairwise, returning two (M, size)
+# matrices of offspring genomes. The genomes of a keyboard are multisets (the blanks and the repeated keys, which can
+# differ between the parents), so each pair of rows is first relabeled as permutations with the occurrence labels of
+# their cells (see _occurrence_labels), the crossovers work on these permutations with position lookup tables (the
+# inverse permutations) and each child is decoded back with the multiset of its own parent.
+# Each crossover function above gets its batched version as its `batch` attribute.
+# -------------------------------------------------------------------------------------------------
+# Batched PMX crossover
+# -------------------------------------------------------------------------------------------------
+def pmx_crossover_matrix(problem, parents1, parents2):
+    """
+    PMX crossover of each pair of rows: the children get the middle part [crosspoint1, crosspoint2) of the opposite
+    parent, and the elements of their own parent that are repeated by it are replaced following the mapping of the
+    middle part. This is the textbook PMX: the scalar pmx_crossover repairs the repeated elements with another rule,
+    so with Batch-Mode the children differ from (and are not only faster than) those of pmx_crossover.
+    """
+    labels1, labels2, values1, values2 = _occurrence_labels(parents1, parents2)
+    n_rows, size = labels1.shape
+
+    crosspoints = _two_diff_order_indices(n_rows, size - 1)
+    columns = np.arange(size)
+    middle = (columns >= crosspoints[:, :1]) & (columns < crosspoints[:, 1:])
+
+    children1 = _pmx(labels1, labels2, middle)
+    children2 = _pmx(labels2, labels1, middle)
+
+    return _decode_labels(children1, values1), _decode_labels(children2, values2)
+
+
+# -------------------------------------------------------------------------------------------------
+# Batched Cycle crossover
+# -------------------------------------------------------------------------------------------------
+def cycle_crossover_matrix(problem, parents1, parents2):
+    """
+    Cycle crossover of each pair of rows: the cycles of positions are numbered by their smallest position, and the
+    children swap the elements of the parents in the even ones (counting from 1)
+    """
+    labels1, labels2, values1, values2 = _occurrence_labels(parents1, parents2)
+    n_rows, size = labels1.shape
+    rows = np.arange(n_rows)[:, None]
+    columns = np.arange(size)
+
+    # next position of each cycle: the position in parent 1 of the element of parent 2
+    step = _inverse_permutations(labels1)[rows, labels2]
+
+    # smallest position of the cycle of each position, by pointer doubling
+    start = np.broadcast_to(columns, (n_rows, size)).copy()
+    for _ in range(int(np.ceil(np.log2(size))) + 1):
+        start = np.minimum(start, start[rows, step])
+        step = step[rows, step]
+
+    # number of the cycle of each position (from 0, in the order of their smallest positions)
+    number = np.cumsum(start == columns, axis=1) - 1
+    swap = (number[rows, start] % 2) == 1
+
+    children1 = np.where(swap, labels2, labels1)
+    children2 = np.where(swap, labels1, labels2)
+
+    return _decode_labels(children1, values1), _decode_labels(children2, values2)
+
+
+# -------------------------------------------------------------------------------------------------
+# Batched Order1 crossover
+# -------------------------------------------------------------------------------------------------
+def order1_crossover_matrix(problem, parents1, parents2):
+    """
+    Order1 crossover of each pair of rows: the children keep the middle part [crosspoint1, crosspoint2] of their own
+    parent, and get the other elements in the order of the opposite parent, starting after the middle part
+    """
+    labels1, labels2, values1, values2 = _occurrence_labels(parents1, parents2)
+    n_rows, size = labels1.shape
+
+    crosspoints = _two_diff_order_indices(n_rows, size - 1)
+    columns = np.arange(size)
+    middle = (columns >= crosspoints[:, :1]) & (columns <= crosspoints[:, 1:])
+
+    # positions after the middle part, in the order they are filled
+    order = (crosspoints[:, 1:] + 1 + columns) % size
+
+    children1 = _order1(labels1, labels2, middle, order)
+    children2 = _order1(labels2, labels1, middle, order)
+
+    return _decode_labels(children1, values1), _decode_labels(children2, values2)
+
+
+pmx_crossover.batch = pmx_crossover_matrix
+cycle_crossover.batch = cycle_crossover_matrix
+order1_crossover.batch = order1_crossover_matrix
+
+
 ###################################################################################################
 # MUTATION APPROACHES
 ###################################################################################################
@@ -844,7 +1116,7 @@ def swap_mutation(problem, solution):
 # Insert mutation
 # -----------------------------------------------------------------------------------------------
 def insert_mutation(problem, solution):
-    solution2 = deepcopy(solution)
+    solution2 = solution.clone()
 
     mutpoint1, mutpoint2 = get_two_diff_order_index(0,(len(solution.representation) - 1))  # get two indexes
 
@@ -861,7 +1133,7 @@ def insert_mutation(problem, solution):
 # Inversion mutation
 # -----------------------------------------------------------------------------------------------
 def inversion_mutation(problem, solution):
-    solution2 = deepcopy(solution)  # create a copy that we will edit and return
+    solution2 = solution.clone()  # create a copy that we will edit and return
 
     mutpoint1, mutpoint2 = get_two_diff_order_index(0, (len(solution.representation) - 1))  # get two indexes
 
@@ -890,7 +1162,7 @@ def scramble_mutation(problem, solution):
 # Greedy Swap mutation
 # -----------------------------------------------------------------------------------------------
 def greedy_mutation(problem, solution):
-    offspring = deepcopy(solution)
+    offspring = solution.clone()
 
     mutpoint1 = randint(0, (len(solution.representation) - 2))
 
@@ -960,6 +1232,94 @@ def multiple_real_mutation(problem, solution):
 
     return solution
 
+
+###################################################################################################
+# BATCHED MUTATION APPROACHES
+###################################################################################################
+# Batched mutation functions mutate in place the rows of an (M, size) genome matrix selected by a boolean mask (all
+# of them by default), drawing the random mutation points of all the rows at once, and return the matrix.
+# Each mutation function above gets its batched version as its `batch` attribute.
+# -------------------------------------------------------------------------------------------------
+# Batched Swap mutation
+# -------------------------------------------------------------------------------------------------
+def swap_mutation_matrix(problem, genomes, mask=None):
+    """
+    Swaps two different positions of each selected row
+    """
+    rows = _mutated_rows(genomes, mask)
+    points = _two_diff_order_indices(len(rows), genomes.shape[1])
+
+    genomes[rows[:, None], points] = genomes[rows[:, None], points[:, ::-1]]
+
+    return genomes
+
+
+# -------------------------------------------------------------------------------------------------
+# Batched Insert mutation
+# -------------------------------------------------------------------------------------------------
+def insert_mutation_matrix(problem, genomes, mask=None):
+    """
+    Moves the element at the second mutation point of each selected row to the position after the first one, shifting
+    the elements in between to the right
+    """
+    rows = _mutated_rows(genomes, mask)
+    points, columns = _mutation_segments(len(rows), genomes.shape[1])
+    mutpoint1, mutpoint2 = points[:, :1], points[:, 1:]
+
+    sources = np.where((columns > mutpoint1 + 1) & (columns <= mutpoint2), columns - 1, columns)
+    sources = np.where(columns == mutpoint1 + 1, mutpoint2, sources)
+
+    genomes[rows] = np.take_along_axis(genomes[rows], sources, axis=1)
+
+    return genomes
+
+
+# -------------------------------------------------------------------------------------------------
+# Batched Inversion mutation
+# -------------------------------------------------------------------------------------------------
+def inversion_mutation_matrix(problem, genomes, mask=None):
+    """
+    Reverses the segment between the two mutation points (both included) of each selected row
+    """
+    rows = _mutated_rows(genomes, mask)
+    points, columns = _mutation_segments(len(rows), genomes.shape[1])
+    mutpoint1, mutpoint2 = points[:, :1], points[:, 1:]
+
+    segment = (columns >= mutpoint1) & (columns <= mutpoint2)
+    sources = np.where(segment, mutpoint1 + mutpoint2 - columns, columns)
+
+    genomes[rows] = np.take_along_axis(genomes[rows], sources, axis=1)
+
+    return genomes
+
+
+# -------------------------------------------------------------------------------------------------
+# Batched Scramble mutation
+# -------------------------------------------------------------------------------------------------
+def scramble_mutation_matrix(problem, genomes, mask=None):
+    """
+    Shuffles the segment between the two mutation points (both included) of each selected row: its positions get
+    random sort keys in [mutpoint1, mutpoint1 + 1), so a single argsort of the rows shuffles only the segments
+    """
+    rows = _mutated_rows(genomes, mask)
+    points, columns = _mutation_segments(len(rows), genomes.shape[1])
+    mutpoint1, mutpoint2 = points[:, :1], points[:, 1:]
+
+    segment = (columns >= mutpoint1) & (columns <= mutpoint2)
+    keys = np.where(segment, mutpoint1 + np.random.random(segment.shape), columns)
+    sources = np.argsort(keys, axis=1)
+
+    genomes[rows] = np.take_along_axis(genomes[rows], sources, axis=1)
+
+    return genomes
+
+
+swap_mutation.batch = swap_mutation_matrix
+insert_mutation.batch = insert_mutation_matrix
+inversion_mutation.batch = inversion_mutation_matrix
+scramble_mutation.batch = scramble_mutation_matrix
+
+
 ###################################################################################################
 # REPLACEMENT APPROACHES
 ###################################################################################################
@@ -967,21 +1327,25 @@ def multiple_real_mutation(problem, solution):
 # Standard replacement
 # -----------------------------------------------------------------------------------------------
 def standard_replacement(problem, current_population, new_population):
-    return deepcopy(new_population)
+    return new_population
 
 # -------------------------------------------------------------------------------------------------
 # Elitism replacement
 # -----------------------------------------------------------------------------------------------
 def elitism_replacement(problem, current_population, new_population):
+    # compare like with like: both fittest solutions with their exact fitness
+    refine_fittest(problem, current_population)
+    refine_fittest(problem, new_population)
+
     if problem.objective == ProblemObjective.Minimization:
         if current_population.fittest.fitness < new_population.fittest.fitness:
-           new_population.solutions[0] = current_population.solutions[-1]
+           new_population.replace_leastfit(current_population.fittest)
 
     elif problem.objective == ProblemObjective.Maximization:
         if current_population.fittest.fitness > new_population.fittest.fitness:
-           new_population.solutions[0] = current_population.solutions[-1]
+           new_population.replace_leastfit(current_population.fittest)
 
-    return deepcopy(new_population)
+    return new_population
 
 ###################################################################################################
 # HELPER FUNCTIONS
@@ -1013,3 +1377,253 @@ def get_two_diff_order_index(start=0, stop=1, order=True, diff=True):
     return first, second
 
 
+def _two_diff_order_indices(n_rows, stop):
+    """
+    n_rows pairs of different, ordered, integers from range(stop) (as get_two_diff_order_index), as an (n_rows, 2)
+    array
+    """
+    first = np.random.randint(0, stop, size=n_rows)
+    second = np.random.randint(0, stop - 1, size=n_rows)
+    second += second >= first
+
+    return np.sort(np.stack((first, second), axis=1), axis=1)
+
+
+def _inverse_permutations(permutations):
+    """
+    Position lookup table of each row of a permutation matrix: inverse[r, permutations[r, i]] = i
+    """
+    n_rows, size = permutations.shape
+    inverse = np.empty_like(permutations)
+    inverse[np.arange(n_rows)[:, None], permutations] = np.arange(size)
+
+    return inverse
+
+
+def _occurrence_labels(genomes1, genomes2):
+    """
+    Relabels the cells of two genome matrices as permutations of range(size), row by row. The cells of genomes1 are
+    labeled with the position of (their element, their occurrence) in the sorted row; the cells of genomes2 with the
+    label of the same (element, occurrence) in genomes1 or, for those missing in genomes1, the labels of the (element,
+    occurrence) pairs of genomes1 missing in genomes2, in order. Returns the two label matrices and the elements of each
+    label in genomes1 and in genomes2, to decode the labels (see _decode_labels): the children decoded with the elements
+    of a parent have its multiset (so the repeated keys and the blanks are preserved).
+    """
+    genomes1 = np.asarray(genomes1)
+    genomes2 = np.asarray(genomes2)
+    n_rows, size = genomes1.shape
+    rows = np.arange(n_rows)[:, None]
+
+    order1 = np.argsort(genomes1, axis=1, kind='stable')
+    order2 = np.argsort(genomes2, axis=1, kind='stable')
+    sorted1 = np.take_along_axis(genomes1, order1, axis=1)
+    sorted2 = np.take_along_axis(genomes2, order2, axis=1)
+
+    # (element, occurrence) pairs of each sorted row missing in the other one
+    missing1 = _occurrences(sorted1) >= _counts(genomes2, sorted1)
+    missing2 = _occurrences(sorted2) >= _counts(genomes1, sorted2)
+
+    # both rows have the same pairs in common, in the same order: put the missing ones first and match them in order
+    matched1 = np.argsort(~missing1, axis=1, kind='stable')
+    matched2 = np.argsort(~missing2, axis=1, kind='stable')
+    labels_sorted2 = np.empty_like(matched2)
+    labels_sorted2[rows, matched2] = matched1
+
+    labels1 = _inverse_permutations(order1)
+    labels2 = labels_sorted2[rows, _inverse_permutations(order2)]
+
+    values2 = np.empty_like(sorted2)
+    values2[rows, labels_sorted2] = sorted2
+
+    return labels1, labels2, sorted1, values2
+
+
+def _occurrences(sorted_genomes):
+    """
+    Occurrence (from 0) of each element of sorted rows
+    """
+    n_rows, size = sorted_genomes.shape
+    columns = np.arange(size)
+    first = np.ones(sorted_genomes.shape, dtype=bool)
+    first[:, 1:] = sorted_genomes[:, 1:] != sorted_genomes[:, :-1]
+
+    return columns - np.maximum.accumulate(np.where(first, columns, 0), axis=1)
+
+
+def _counts(genomes, elements):
+    """
+    Number of times each of the elements (one row of elements per row of genomes) occurs in the row of genomes
+    """
+    n_rows = len(genomes)
+    n_elements = int(max(genomes.max(), elements.max())) + 1
+    offsets = np.arange(n_rows)[:, None] * n_elements
+
+    counts = np.bincount((genomes + offsets).ravel(), minlength=n_rows * n_elements)
+    return counts[elements + offsets]
+
+
+def _decode_labels(labels, values):
+    """
+    Genome matrix of a label matrix, given the elements of the labels (see _occurrence_labels)
+    """
+    return np.take_along_axis(values, labels, axis=1)
+
+
+def _pmx(labels1, labels2, middle):
+    """
+    PMX child of label matrices: the middle of labels2 and the rest of labels1, each repeated element being mapped
+    through the middle part until it is not repeated
+    """
+    rows = np.arange(len(labels1))[:, None]
+    position2 = _inverse_permutations(labels2)
+
+    child = np.where(middle, labels2, labels1)
+    repeated = ~middle & middle[rows, position2[rows, child]]
+
+    while repeated.any():
+        r, c = np.nonzero(repeated)
+        child[r, c] = labels1[r, position2[r, child[r, c]]]
+        repeated[r, c] = middle[r, position2[r, child[r, c]]]
+
+    return child
+
+
+def _order1(labels1, labels2, middle, order):
+    """
+    Order1 child of label matrices: the middle of labels1, the other positions filled (in the given order) with the
+    elements of labels2 that are not in it, in the same order
+    """
+    rows = np.arange(len(labels1))[:, None]
+    position1 = _inverse_permutations(labels1)
+
+    # elements of labels2, in order, without those in the middle of labels1 (moved to the end by a stable sort)
+    sequence = labels2[rows, order]
+    in_middle = middle[rows, position1[rows, sequence]]
+    sequence = np.take_along_axis(sequence, np.argsort(in_middle, axis=1, kind='stable'), axis=1)
+
+    # the positions out of the middle are the first ones of the order
+    fill = np.arange(labels1.shape[1]) < (~middle).sum(axis=1)[:, None]
+
+    child = labels1.copy()
+    child[np.nonzero(fill)[0], order[fill]] = sequence[fill]
+
+    return child
+
+
+def _mutated_rows(genomes, mask):
+    """
+    Indices of the rows of a genome matrix selected by a mutation mask (all of them without one)
+    """
+    if mask is None:
+        return np.arange(len(genomes))
+    return np.flatnonzero(mask)
+
+
+def _mutation_segments(n_rows, size):
+    """
+    Mutation points of n_rows rows (different and ordered, from range(size - 1) as in the mutation functions) and the
+    column indices, to broadcast with them
+    """
+    return _two_diff_order_indices(n_rows, size - 1), np.arange(size)
+
+
+def _roulette_weights(fitness, objective):
+    """
+    Slices of the roulette wheel of each solution: its fitness (maximization) or, in minimization, the complement of
+    its share of the total fitness
+    """
+    fitness = np.asarray(fitness, dtype=np.float64)
+
+    if objective == ProblemObjective.Maximization:
+        return fitness
+    elif objective == ProblemObjective.Minimization:
+        return 1 - fitness / fitness.sum()
+    else:
+        print('The code does not handle multiobjective problems yet.')
+        exit(code=1)
+
+
+def _spin_wheel(weights, n_pairs):
+    """
+    Spins a roulette wheel with slices of the given (non negative) weights 2 * n_pairs times, returning an
+    (n_pairs, 2) array of indices. The second spin of each pair is done on the wheel without the slice of the first
+    index (its slice is skipped), so the two indices of a pair are always different.
+    """
+    size = len(weights)
+    if size < 2:
+        return np.zeros((n_pairs, 2), dtype=np.intp)
+
+    stops = np.cumsum(weights)
+    total = stops[-1]
+
+    index1 = np.searchsorted(stops, np.random.random(n_pairs) * total, side='right')
+    index1 = np.minimum(index1, size - 1)
+
+    excluded = weights[index1]
+    position = np.random.random(n_pairs) * (total - excluded)
+    position += np.where(position >= stops[index1] - excluded, excluded, 0)
+    index2 = np.searchsorted(stops, position, side='right')
+    index2 = np.minimum(index2, size - 1)
+
+    return np.stack((index1, index2), axis=1)
+
+
+def _pair_mating_pool(pool):
+    """
+    Pairs the indices of a mating pool at random: the pool is shuffled and its i-th index is paired with its
+    (n_pairs + i)-th, returning an (n_pairs, 2) array
+    """
+    n_pairs = len(pool) // 2
+    pool = np.random.permutation(pool)
+
+    return np.stack((pool[:n_pairs], pool[n_pairs:2 * n_pairs]), axis=1)
+
+
+def build_distinct_population(problem, population_size, method, max_attempts=100):
+    """
+    Builds and evaluates a population of admissible solutions with the given build_solution method, rejecting the
+    solutions equivalent to one already in it (after max_attempts rejections in a row the duplicate is accepted, so
+    methods with few distinct solutions still fill the population).
+    """
+    solution_list = []
+    seen = set()
+    attempts = 0
+
+    while len(solution_list) < population_size:
+        s = problem.build_solution(method=method)
+        if not problem.is_admissible(s):
+            continue
+
+        key = problem.canonical_key(s)
+        if key in seen and attempts < max_attempts:
+            attempts += 1
+            continue
+
+        s.id = [0, len(solution_list)]
+        solution_list.append(s)
+        seen.add(key)
+        attempts = 0
+
+    # evaluate the whole initial population at once
+    problem.evaluate_solutions(solution_list)
+
+    return Population(
+        problem = problem,
+        maximum_size = population_size,
+        solution_list = solution_list
+    )
+
+
+def refine_fittest(problem, population):
+    """
+    Evaluates exactly the fittest solution of the population until the fittest one has an exact fitness (screened
+    fitness values are optimistic, so the exact one can fall behind another solution). Returns the fittest solution.
+    """
+    fittest = population.fittest
+    while fittest is not None and fittest.fitness_fidelity != FitnessFidelity.Exact:
+        problem.refine_solutions([fittest])
+        fittest = population.fittest
+
+    return fittest
+
+
@@ -17,15 +17,18 @@ Author: Fernando A J Peres - fperes@novaims.unl.pt - (2019) version L4.0
 # -------------------------------------------------------------------------------------------------
 
 from random import random
-from copy import deepcopy
+
+import numpy as np
 
 from dssg_challenge.ga.algorithm.ga_operators import (initialize_using_random,
 rank_selection, roulettewheel_selection, tournament_selection,
 singlepoint_crossover, single_point_mutation, standard_replacement, 
-elitism_replacement)
+elitism_replacement, refine_fittest)
 
-from dssg_challenge.ga.problem.population import Population
+from dssg_challenge.ga.problem.population import Population, ArrayPopulation
 from dssg_challenge.ga.problem.objective import ProblemObjective
+from dssg_challenge.ga.problem.fidelity import FitnessFidelity
+from dssg_challenge.ga.util.indexed_heap import IndexedHeap
 
 from dssg_challenge.ga.util.terminal import Terminal, FontColor
 
@@ -88,6 +91,8 @@ class GeneticAlgorithm:
         self._population        = None
         self._observers         = []
         self._best_solution     = None
+        self._last_improvement  = 0
+        self._stop_reason       = None
 
         self._parse_params(params)
 
@@ -110,41 +115,108 @@ class GeneticAlgorithm:
                     1. Selection
                     2. Try Apply Crossover (depends on the crossover probability)
                     3. Try Apply Mutation (depends on the mutation probability)
+                    (in Batch-Mode, the whole generation at once: see _breed_population)
                 
-                2.2. Replacement
+                2.2. Evaluate the new generation (with Multi-Fidelity: screen it, then evaluate exactly the
+                     candidates to the elite)
+
+                2.3. Replacement
+
+            3. Return the best solution (with its exact fitness, if it was estimated during the search)
 
-            3. Return the best solution    
+            The search stops early when a stop criterion is met (Stagnation-Generations, Diversity-Threshold or
+            Target-Fitness); the reason is recorded in the log.
         """
-        problem         = self._problem_instance
-        select          = self._selection_approach
-        cross           = self._crossover_approach
-        mutate          = self._mutation_approach
-        replace         = self._replacement_approach
-        is_admissible   = self._problem_instance.is_admissible
+        self.initialize()
+
+        #2. Repeat n generations )(#1 loop ), unless a stop criterion is met first (see _check_stop)
+        for _ in range(self._number_of_generations):
+            self.step()
+            self._stop_reason = self._check_stop()
+            if self._stop_reason is not None:
+                break
+
+        return self.finalize()
+
+    # initialize / step / finalize: the search one generation at a time (e.g. for the islands of IslandModel)
+    # ---------------------------------------------------------------------------------------------
+    def initialize(self):
+        """
+        Step 1 of the search: creates and evaluates the initial population (generation 0)
+        """
+        problem = self._problem_instance
 
         self._generation = 0
+        self._last_improvement = 0
+        self._stop_reason = None
         self._notify(message="Genetic Algorithm")
 
+        if self._evaluation_workers is not None:
+            problem.set_evaluation_workers(self._evaluation_workers)
+
         # 1. Initial population
+        self._update_estimator()
         self._population = self._initialize(problem, self._population_size)
+        if self._batch_mode:
+            self._population = ArrayPopulation.from_solutions(problem, self._population_size, self._population.solutions)
         self._fittest = self._population.fittest
-        self._best_solution = self._fittest
+        self._best_solution = self._exact_copy(self._fittest)
 
+        if self._steady_state:
+            # the rows of the population are replaced in place (see _insert): the fittest solution is kept as a copy
+            self._fittest = self._fittest.clone()
+            # fitness of each solution, and the heap of the solutions from the least fit (see _loser)
+            self._steady_fitness = np.array(self._population.fitness, dtype=np.float64)
+            self._heap = IndexedHeap(self._fitness_keys(self._steady_fitness))
 
         self._notify()
 
-        #2. Repeat n generations )(#1 loop )
-        for self._generation in range(1, self._number_of_generations + 1):
+    def step(self):
+        """
+        Step 2 of the search: breeds, evaluates and replaces one generation
+        """
+        problem         = self._problem_instance
+        select          = self._selection_approach
+        cross           = self._crossover_approach
+        mutate          = self._mutation_approach
+        replace         = self._replacement_approach
+        is_admissible   = self._problem_instance.is_admissible
+
+        self._generation += 1
+        self._update_estimator()
+
+        if self._steady_state:
+            # 2. Steady-state: a generation worth of offspring, inserted one step at a time
+            bred = 0
+            while bred < self._population_size:
+                bred += self.steady_step()
+
+            self._notify()
+            return
+
+        if self._batch_mode:
+            # 2.1. The whole next generation at once, with the batched operators
+            new_population = self._breed_population()
+        else:
             new_population = Population(problem=problem, maximum_size=self._population_size, solution_list=[])
             i = 0
 
+            # canonical keys of the new generation, to reject duplicated offspring (see _is_new)
+            seen = {}
+
+            pairs = None
+            if getattr(select, "mating_pool", False) or (self._batch_selection and hasattr(select, "batch")):
+                pairs = self._mating_pairs()
+
             # 2.1. Repeat until generate the next generation (#2 loop )
             while new_population.has_space:
                 # 2.1.1. Selection
-                parent1, parent2 = select(self._population, problem.objective, self._params)
-                offspring1 = deepcopy(parent1)  # parent1.clone()
-                offspring2 = deepcopy(parent2)  # parent2.clone()
-                # 2.1.2. Try Apply Crossover (depends on the crossover probability)
+                if pairs is not None:
+                    parent1, parent2 = next(pairs)
+                else:
+                    parent1, parent2 = select(self._population, problem.objective, self._params)
+                # 2.1.2. Try Apply Crossover (depends on the crossover probability); the crossover returns new
+                # solutions, otherwise the offspring are clones of the parents
                 if self.apply_crossover: 
                     offspring1, offspring2 = cross(problem, parent1, parent2)
                     offspring1.id = [self._generation, i]
@@ -152,6 +224,9 @@ class GeneticAlgorithm:
                     offspring2.id = [self._generation, i]
                     #i += 2
                     i += 1
+                else:
+                    offspring1 = parent1.clone()
+                    offspring2 = parent2.clone()
 
                 # 2.1.3. Try Apply Mutation (depends on the mutation probability)
                 if self.apply_mutation: 
@@ -167,25 +242,277 @@ class GeneticAlgorithm:
                 # change because it is not relevant
 
                 # add the offsprings in the new population (New Generation)
-                if new_population.has_space and is_admissible(offspring1):
-                    problem.evaluate_solution(offspring1)
-                    new_population.solutions.append(offspring1)
+                if new_population.has_space and is_admissible(offspring1) and self._is_new(offspring1, seen):
+                    new_population.add(offspring1)
                 
-                if new_population.has_space and is_admissible(offspring2):
-                    problem.evaluate_solution(offspring2)
-                    new_population.solutions.append(offspring2)
+                if new_population.has_space and is_admissible(offspring2) and self._is_new(offspring2, seen):
+                    new_population.add(offspring2)
                     #print(f'Added O2 - {offspring2.id}-{offspring2.representation}')
 
-            self._population = replace(problem, self._population, new_population)
+        # 2.2. Evaluate the whole new generation at once
+        if self._multi_fidelity:
+            # cheap screening, then exact fitness only for the offspring that could beat the fittest solution
+            problem.screen_solutions(new_population.solutions)
+            problem.refine_solutions(self._elite_candidates(new_population))
+        elif self._batch_mode and self._sample_size is None:
+            new_population.set_fitness(problem.evaluate_population(new_population.genomes))
+        else:
+            problem.evaluate_solutions(new_population.solutions)
+            if self._rank_sample_factor is not None and problem.sample_size:
+                # larger samples for the fitter offspring (see _rank_sample_sizes)
+                solutions, sample_sizes = self._rank_sample_sizes(new_population.solutions)
+                problem.evaluate_solutions(solutions, sample_sizes=sample_sizes)
+
+        # 2.3. Replacement (with the estimator, elitism compares estimates from the sample of this generation)
+        if problem.sample_size:
+            problem.evaluate_solutions([self._population.fittest])
+        self._population = replace(problem, self._population, new_population)
+        if self._multi_fidelity:
+            refine_fittest(problem, self._population)
+
+        self._fittest = self._population.fittest
 
+        self.find_best_solution()
+
+        self._notify()
+
+    def finalize(self):
+        """
+        Step 3 of the search: returns the fittest solution of the last generation
+        """
+        problem = self._problem_instance
+
+        # 3. The fitness of the final population and of the best solution is always exact
+        if self._sample_size is not None:
+            problem.set_estimator(None)
+            problem.evaluate_solutions(self._population.solutions + [self._best_solution])
             self._fittest = self._population.fittest
+            self.find_best_solution()
+
+        self._logger.set_stop_reason(self._stop_reason or "Number-of-Generations")
+        self._notify(message="Fittest Solution")
+        return self._fittest
+
+    # stop criteria
+    # ---------------------------------------------------------------------------------------------
+    def _check_stop(self):
+        """
+        The name of the first stop criterion met by the current generation, or None:
+            - Stagnation-Generations: the best solution didn't improve for that many generations
+            - Diversity-Threshold: the diversity of the population (see Population.diversity) fell below it
+            - Target-Fitness: the best solution reached it
+        """
+        if self._stagnation_generations is not None:
+            if self._generation - self._last_improvement >= self._stagnation_generations:
+                return "Stagnation-Generations"
+
+        if self._diversity_threshold is not None:
+            if self._population.diversity < self._diversity_threshold:
+                return "Diversity-Threshold"
+
+        if self._target_fitness is not None:
+            fitness = self._best_solution.fitness
+            if self._problem_instance.objective == ProblemObjective.Minimization:
+                if fitness <= self._target_fitness:
+                    return "Target-Fitness"
+            elif fitness >= self._target_fitness:
+                return "Target-Fitness"
+
+        return None
+
+    @property
+    def stop_reason(self):
+        """
+        Why the last search stopped: the name of the stop criterion met, or "Number-of-Generations"
+        """
+        return self._logger.stop_reason
+
+    # steady-state
+    # ---------------------------------------------------------------------------------------------
+    def steady_step(self):
+        """
+        Steady-state step: selects one pair of parents (see _steady_parents), breeds them (in Batch-Mode with the
+        batched operators, see _breed_pair) and evaluates the admissible offspring (with Multi-Fidelity only screens
+        them, see _insert), which are inserted in the population (see _insert). Returns the number of offspring
+        evaluated.
+        """
+        problem = self._problem_instance
+        population = self._population
+
+        index1, index2 = self._steady_parents()
+
+        if self._batch_mode:
+            offspring = self._breed_pair(index1, index2)
+        else:
+            parent1, parent2 = population.get(index1), population.get(index2)
+
+            if self.apply_crossover:
+                offspring1, offspring2 = self._crossover_approach(problem, parent1, parent2)
+            else:
+                offspring1 = parent1.clone()
+                offspring2 = parent2.clone()
+
+            if self.apply_mutation:
+                offspring1 = self._mutation_approach(problem, offspring1)
+            if self.apply_mutation:
+                offspring2 = self._mutation_approach(problem, offspring2)
+
+            offspring = [solution for solution in (offspring1, offspring2) if problem.is_admissible(solution)]
+
+        if self._multi_fidelity:
+            problem.screen_solutions(offspring)
+        else:
+            problem.evaluate_solutions(offspring)
+
+        for solution in offspring:
+            self._insert(solution)
+
+        return len(offspring)
+
+    def _steady_parents(self):
+        """
+        Indices of a pair of parents. With the tournament selection approach, the winners of two tournaments of
+        Tournament-Size random solutions (the second one without the first winner), compared by their keys in the heap
+        in O(Tournament-Size); otherwise a pair drawn with the batched selection approach, in O(N).
+        """
+        if self._selection_approach is not tournament_selection:
+            pairs = self._batched_selection_approach(self._steady_fitness, self._problem_instance.objective, 1,
+                                                     self._params)
+            return pairs[0][0], pairs[0][1]
+
+        tournament_size = 2
+        if "Tournament-Size" in self._params:
+            tournament_size = self._params["Tournament-Size"]
+
+        size = len(self._heap)
+        if size < 2:
+            return 0, 0
+
+        index1 = max(np.random.randint(0, size, size=tournament_size), key=self._heap.key)
+
+        # draw from the population without index1, shifting the indices after it
+        contenders = np.random.randint(0, size - 1, size=tournament_size)
+        contenders += contenders >= index1
+        index2 = max(contenders, key=self._heap.key)
+
+        return index1, index2
 
+    def _breed_pair(self, index1, index2):
+        """
+        Batch-Mode steady-state breeding: the batched crossover and mutation approaches are applied to the two-row
+        genome matrix of the parents at index1 and index2. Returns the admissible offspring (not evaluated).
+        """
+        problem = self._problem_instance
+        genomes = self._population.genomes[[index1, index2]]
+
+        if self.apply_crossover:
+            offspring1, offspring2 = self._crossover_approach.batch(problem, genomes[:1], genomes[1:])
+            genomes = np.concatenate((offspring1, offspring2))
+
+        mutated = np.random.random(2) < self._mutation_probability
+        self._mutation_approach.batch(problem, genomes, mutated)
+
+        genomes = genomes[problem.admissible_layouts(genomes)]
+        return ArrayPopulation(problem, len(genomes), genomes=genomes).solutions
+
+    def _insert(self, solution):
+        """
+        Puts the (evaluated) solution in place of the loser of the population (see _loser) if it is fitter, in
+        O(log N). A screened solution (see Multi-Fidelity) is evaluated exactly only if its screened fitness beats the
+        loser, so the population keeps exact fitness values.
+        """
+        loser = self._loser()
+        key = self._fitness_keys(solution.fitness)
+        if key <= self._heap.key(loser):
+            return
+
+        if self._multi_fidelity and solution.fitness_fidelity != FitnessFidelity.Exact:
+            self._problem_instance.refine_solutions([solution])
+            key = self._fitness_keys(solution.fitness)
+            if key <= self._heap.key(loser):
+                return
+
+        self._population.replace(loser, solution)
+        self._steady_fitness[loser] = solution.fitness
+        self._heap.update(loser, key)
+
+        if key > self._fitness_keys(self._fittest.fitness):
+            self._fittest = self._population.get(loser).clone()
             self.find_best_solution()
 
-            self._notify()
+    def _loser(self):
+        """
+        Index of the solution to replace: the least fit one (the top of the heap) or the least fit of Tournament-Size
+        random solutions
+        """
+        if self._steady_replacement == "Tournament":
+            contenders = np.random.randint(0, len(self._heap), size=self._tournament_size)
+            return min(contenders, key=self._heap.key)
 
-        self._notify(message="Fittest Solution")
-        return self._fittest    
+        return self._heap.top()
+
+    def _steady_top(self, n_solutions):
+        """
+        Indices of the n_solutions fittest solutions, the fittest first, read from the keys of the heap. With
+        Multi-Fidelity, the ones whose fitness is not exact are refined in place (and their keys updated) until the top
+        is exact.
+        """
+        while True:
+            top = np.argsort(self._heap.keys)[::-1][:n_solutions]
+            screened = [self._population.get(index) for index in top
+                        if self._population.get(index).fitness_fidelity != FitnessFidelity.Exact]
+            if not (self._multi_fidelity and screened):
+                return top
+
+            self._problem_instance.refine_solutions(screened)
+            for index in top:
+                fitness = self._population.get(index).fitness
+                self._steady_fitness[index] = fitness
+                self._heap.update(index, self._fitness_keys(fitness))
+
+    def _fitness_keys(self, fitness):
+        # the keys of the heap grow with the fitness of the solutions, whatever the objective
+        if self._problem_instance.objective == ProblemObjective.Minimization:
+            return -fitness
+        return fitness
+
+    # migration (see IslandModel)
+    # ---------------------------------------------------------------------------------------------
+    def emigrants(self, n_solutions):
+        """
+        Copies of the n_solutions fittest solutions of the population, the fittest first
+        """
+        if self._steady_state:
+            # sorting a Population would move its solutions out of their places in the heap
+            top = self._steady_top(n_solutions)
+        else:
+            if self._multi_fidelity:
+                refine_fittest(self._problem_instance, self._population)
+            top = self._population.top(n_solutions)
+
+        return [self._population.get(index).clone() for index in top]
+
+    def immigrate(self, solutions):
+        """
+        Each (evaluated) solution replaces the least fit solution of the population, if it is fitter
+        """
+        if self._steady_state:
+            for solution in solutions:
+                self._insert(solution.clone())
+            return
+
+        minimization = self._problem_instance.objective == ProblemObjective.Minimization
+        for solution in solutions:
+            least_fit = self._population.least_fit
+            if (solution.fitness < least_fit.fitness) if minimization else (solution.fitness > least_fit.fitness):
+                self._population.replace_leastfit(solution.clone())
+
+        self._fittest = self._population.fittest
+        self.find_best_solution()
+
+    @property
+    def generation(self):
+        return self._generation
 
     def __str__(self):
         self._text = ""
@@ -237,7 +564,8 @@ class GeneticAlgorithm:
             print("Undefined Initialization approach. The default will be used.")
             self._initialize = initialize_using_random
         
-        # Selection
+        # Selection: a function selecting one parent pair or, if it has a true `mating_pool` attribute, the whole
+        # mating pool of a generation (see stochastic_universal_sampling)
         self._selection_approach = None
         if "Selection-Approach" in params:
             self._selection_approach = params["Selection-Approach"]
@@ -275,9 +603,247 @@ class GeneticAlgorithm:
             print("Undefined Replacement-Approach. The default will be used.")
             self._replacement_approach = elitism_replacement
 
+        # Fitness estimation: the sample size of the estimator (see AlsKeyboardProblem.set_estimator) or a function
+        # of the generation returning it (None or 0 for the exact fitness). None disables the estimator altogether.
+        self._sample_size = None
+        if "Sample-Size" in params:
+            self._sample_size = params["Sample-Size"]
+
+        # Rank-based sample sizes: with the estimator, the offspring of each generation (not in Steady-State) are
+        # estimated again with samples growing with their fitness rank, up to Rank-Sample-Factor times the Sample-Size
+        # for the fittest (see _rank_sample_sizes). None gives the same sample size to all of them.
+        self._rank_sample_factor = None
+        if "Rank-Sample-Factor" in params:
+            self._rank_sample_factor = params["Rank-Sample-Factor"]
+
+        # Reject offspring equivalent to another one of the same generation (see ProblemTemplate.canonical_key)
+        self._reject_duplicates = False
+        if "Reject-Duplicates" in params:
+            self._reject_duplicates = params["Reject-Duplicates"]
+
+        # Multi-fidelity evaluation: screen the offspring with a cheap fitness (see ProblemTemplate.screen_solutions)
+        self._multi_fidelity = False
+        if "Multi-Fidelity" in params:
+            self._multi_fidelity = params["Multi-Fidelity"]
+
+        # Batch selection: draw the parents of a whole generation at once with the batched version of the selection
+        # approach (its `batch` attribute, see roulettewheel_indices), when it has one
+        self._batch_selection = False
+        if "Batch-Selection" in params:
+            self._batch_selection = params["Batch-Selection"]
+
+        # Steady-state: each step breeds one pair of parents, and each offspring replaces in place the worst solution
+        # of the population (Steady-State-Replacement "Worst") or the loser of a tournament ("Tournament") if it is
+        # fitter (see steady_step); a generation is Population-Size offspring. The selection approach needs a batched
+        # version (tournaments are run on the heap, see _steady_parents), and the offspring are evaluated exactly (or
+        # estimated) as they are bred, or screened first with Multi-Fidelity.
+        self._steady_state = False
+        if "Steady-State" in params:
+            self._steady_state = params["Steady-State"]
+
+        self._steady_replacement = "Worst"
+        if "Steady-State-Replacement" in params:
+            self._steady_replacement = params["Steady-State-Replacement"]
+
+        if self._steady_state and not (getattr(self._selection_approach, "mating_pool", False)
+                                       or hasattr(self._selection_approach, "batch")):
+            print("Steady-State needs a batched selection approach. It will not be used.")
+            self._steady_state = False
+
+        # Stop criteria (None disables them): generations without improving the best solution, minimum diversity of
+        # the population and fitness to reach (see _check_stop)
+        self._stagnation_generations = None
+        if "Stagnation-Generations" in params:
+            self._stagnation_generations = params["Stagnation-Generations"]
+
+        self._diversity_threshold = None
+        if "Diversity-Threshold" in params:
+            self._diversity_threshold = params["Diversity-Threshold"]
+
+        self._target_fitness = None
+        if "Target-Fitness" in params:
+            self._target_fitness = params["Target-Fitness"]
+
+        # Evaluation workers: number of processes evaluating the offspring (see AlsKeyboardProblem.set_evaluation_workers);
+        # the pool persists across generations (and runs on the same problem). None leaves the problem as it is.
+        self._evaluation_workers = None
+        if "Evaluation-Workers" in params:
+            self._evaluation_workers = params["Evaluation-Workers"]
+
+        # Batch mode: breed, check and evaluate each generation as a genome matrix (see _breed_population); the
+        # selection, crossover and mutation approaches need batched versions (their `batch` attribute). The batched
+        # pmx_crossover is the textbook PMX, whose children differ from those of the scalar one (see pmx_crossover_matrix)
+        self._batch_mode = False
+        if "Batch-Mode" in params:
+            self._batch_mode = params["Batch-Mode"]
+
+        if self._batch_mode:
+            selection = self._selection_approach
+            batched = getattr(selection, "mating_pool", False) or hasattr(selection, "batch")
+            batched = batched and hasattr(self._crossover_approach, "batch") and hasattr(self._mutation_approach, "batch")
+            if not batched:
+                print("Batch-Mode needs batched selection, crossover and mutation approaches. It will not be used.")
+                self._batch_mode = False
+
         self._notify(message="Configuration", content=self._text)
 
 
+    # duplicate detection
+    #----------------------------------------------------------------------------------------------
+    def _is_new(self, solution, seen, max_rejections=100):
+        """
+        False if duplicates are rejected and the solution is equivalent to one already in the generation (seen maps
+        their canonical keys to the number of rejected copies, and each key is accepted again after max_rejections,
+        so a converged population can still be filled)
+        """
+        if not self._reject_duplicates:
+            return True
+
+        key = self._problem_instance.canonical_key(solution)
+        if key in seen and seen[key] < max_rejections:
+            seen[key] += 1
+            return False
+
+        seen[key] = 0
+        return True
+
+    # mating pairs
+    #----------------------------------------------------------------------------------------------
+    def _mating_pairs(self):
+        """
+        Parent pairs for the next generation, drawn from the current population with the mating pool selection approach
+        or the batched version of the selection approach (enough pairs for a full generation per call, drawing more if
+        offspring are rejected)
+        """
+        population = self._population
+        fitness = population.fitness
+        select = self._batched_selection_approach
+        n_pairs = (self._population_size + 1) // 2
+
+        while True:
+            for index1, index2 in select(fitness, self._problem_instance.objective, n_pairs, self._params):
+                yield population.get(index1), population.get(index2)
+
+    @property
+    def _batched_selection_approach(self):
+        """
+        The mating pool selection approach, or the batched version of the selection approach
+        """
+        select = self._selection_approach
+        if getattr(select, "mating_pool", False):
+            return select
+        return select.batch
+
+    # batch mode
+    #----------------------------------------------------------------------------------------------
+    def _breed_population(self, max_rounds=100):
+        """
+        Batch-Mode generation: breeds offspring genome matrices (see _breed) until there are enough admissible ones,
+        rejecting in bulk the inadmissible offspring and (with Reject-Duplicates, for max_rounds rounds) the offspring
+        equivalent to a previous one. Returns the new generation as an ArrayPopulation, not evaluated.
+        """
+        problem = self._problem_instance
+        size = self._population_size
+
+        offspring = np.empty((0, problem.encoding.size), dtype=np.uint8)
+        rounds = 0
+        while len(offspring) < size:
+            genomes = self._breed(size)
+            offspring = np.concatenate((offspring, genomes[problem.admissible_layouts(genomes)]))
+
+            if self._reject_duplicates and rounds < max_rounds:
+                _, first = np.unique(problem.canonical_layouts(offspring), axis=0, return_index=True)
+                offspring = offspring[np.sort(first)]
+            rounds += 1
+
+        return ArrayPopulation(problem, size, genomes=offspring[:size])
+
+    def _breed(self, n_offspring):
+        """
+        Genome matrix of n_offspring offspring of the current population: the parents of all the pairs are selected at
+        once, and the batched crossover and mutation approaches are applied to the rows picked by random masks (with
+        the crossover and mutation probabilities)
+        """
+        problem = self._problem_instance
+        population = self._population
+        n_pairs = (n_offspring + 1) // 2
+
+        pairs = self._batched_selection_approach(population.fitness, problem.objective, n_pairs, self._params)
+        parents = population.genomes[pairs]
+
+        crossed = np.random.random(n_pairs) < self._crossover_probability
+        if crossed.any():
+            offspring1, offspring2 = self._crossover_approach.batch(problem, parents[crossed, 0], parents[crossed, 1])
+            parents[crossed, 0] = offspring1
+            parents[crossed, 1] = offspring2
+
+        offspring = parents.reshape(2 * n_pairs, -1)
+        mutated = np.random.random(len(offspring)) < self._mutation_probability
+        self._mutation_approach.batch(problem, offspring, mutated)
+
+        return offspring[:n_offspring]
+
+    # elite candidates
+    #----------------------------------------------------------------------------------------------
+    def _elite_candidates(self, new_population):
+        """
+        Screened solutions of the new population whose fitness, allowing for two standard errors, is better than the
+        exact fitness of the fittest solution of the current population
+        """
+        elite = refine_fittest(self._problem_instance, self._population).fitness
+        candidates = []
+
+        for solution in new_population.solutions:
+            if solution.fitness_fidelity == FitnessFidelity.Exact:
+                continue
+            margin = 2 * solution.fitness_stderr
+            if self._problem_instance.objective == ProblemObjective.Minimization:
+                if solution.fitness - margin < elite:
+                    candidates.append(solution)
+            elif solution.fitness + margin > elite:
+                candidates.append(solution)
+
+        return candidates
+
+    # rank-based sample sizes
+    #----------------------------------------------------------------------------------------------
+    def _rank_sample_sizes(self, solutions):
+        """
+        The (estimated) solutions to estimate again and their sample sizes, growing linearly with their fitness rank
+        from the sample size of the generation, for the least fit, to Rank-Sample-Factor times it, for the fittest (the
+        ones keeping the sample size of the generation are left out, their estimate would not change)
+        """
+        sample_size = self._problem_instance.sample_size
+        keys = self._fitness_keys(np.array([solution.fitness for solution in solutions], dtype=np.float64))
+        order = np.argsort(keys, kind='stable')  # least fit first
+
+        sizes = np.rint(sample_size * np.linspace(1, self._rank_sample_factor, len(solutions))).astype(int)
+        larger = sizes > sample_size
+
+        return [solutions[index] for index in order[larger]], sizes[larger].tolist()
+
+    def _exact_copy(self, solution):
+        """
+        Copy of the solution with its exact fitness, evaluated again if it is an estimate (see Sample-Size)
+        """
+        copy = solution.clone()
+        if copy.fitness_fidelity == FitnessFidelity.Sample:
+            self._problem_instance.evaluate_solution(copy, sample_size=0)
+        return copy
+
+    # update estimator
+    #----------------------------------------------------------------------------------------------
+    def _update_estimator(self):
+        if self._sample_size is None:
+            return
+
+        sample_size = self._sample_size
+        if callable(sample_size):
+            sample_size = sample_size(self._generation)
+
+        # a new sample of the corpus for each generation
+        self._problem_instance.set_estimator(sample_size, seed=(self._run, self._generation))
+
     # register observer
     #----------------------------------------------------------------------------------------------
     def register_observer(self, observer):
@@ -332,13 +898,20 @@ class GeneticAlgorithm:
     #    return weight
 
     # find the best solution for each generation in each run
+    # (an estimated fittest solution only becomes the best one if its exact fitness is better, see _exact_copy)
     def find_best_solution(self):
         if self._problem_instance.objective == ProblemObjective.Minimization:
             if self._fittest.fitness < self._best_solution.fitness:
-                self._best_solution = deepcopy(self._fittest)
+                candidate = self._exact_copy(self._fittest)
+                if candidate.fitness < self._best_solution.fitness:
+                    self._best_solution = candidate
+                    self._last_improvement = self._generation
         elif self._problem_instance.objective == ProblemObjective.Maximization:
             if self._fittest.fitness > self._best_solution.fitness:
-                self._best_solution = deepcopy(self._fittest)
+                candidate = self._exact_copy(self._fittest)
+                if candidate.fitness > self._best_solution.fitness:
+                    self._best_solution = candidate
+                    self._last_improvement = self._generation
         else:
             print('The code does not handle multiobjective problems yet.')
             exit(code=1)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------------------------------
+"""
+Island Model Genetic Algorithm
+----------------------------
+
+Content:
+
+▶ class IslandModel
+
+─────────────────────────────────────────────────────────────────────────
+"""
+# -------------------------------------------------------------------------------------------------
+import math
+import os
+import random
+import signal
+import sys
+import traceback
+from collections import namedtuple
+from multiprocessing import Pipe, Process
+
+import numpy as np
+
+from dssg_challenge.ga.algorithm.genetic_algorithm import GeneticAlgorithm, default_params
+from dssg_challenge.ga.problem.objective import ProblemObjective
+
+
+# -------------------------------------------------------------------------------------------------
+# Migration topologies: the islands receiving the emigrants of each island
+# -------------------------------------------------------------------------------------------------
+def ring_topology(n_islands):
+    return [[(island + 1) % n_islands] for island in range(n_islands)]
+
+
+def complete_topology(n_islands):
+    return [[other for other in range(n_islands) if other != island] for island in range(n_islands)]
+
+
+topologies = {
+    "Ring"      : ring_topology,
+    "Complete"  : complete_topology
+}
+
+
+# -------------------------------------------------------------------------------------------------
+# Island process
+# -------------------------------------------------------------------------------------------------
+def _island(connection, problem_instance, params, epochs, migration_size, seed, run, log_name, log_dir):
+    """
+    Evolves one population: after each epoch (but the last) of generations it sends its emigrants through the
+    connection and receives the immigrants of the other islands. At the end it sends its best solution and the
+    fitness of its fittest solution in each generation. An error is sent instead, to be raised by the driver.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+    # stopped by the driver (see IslandModel.search): exit through the finally clause, which frees the evaluation pool
+    signal.signal(signal.SIGTERM, _exit)
+
+    try:
+        ga = GeneticAlgorithm(problem_instance, params, run=run, log_name=log_name, log_dir=log_dir)
+        history = []
+
+        ga.initialize()
+        history.append(ga.get_state()["fittest"].fitness)
+
+        for epoch, generations in enumerate(epochs):
+            for _ in range(generations):
+                ga.step()
+                history.append(ga.get_state()["fittest"].fitness)
+
+            if epoch < len(epochs) - 1:
+                connection.send(ga.emigrants(migration_size))
+                ga.immigrate(_receive(connection))
+
+        ga.finalize()
+        connection.send((ga.best_solution.clone(), history))
+    except Exception as error:
+        connection.send(_IslandError(type(error).__name__, str(error), traceback.format_exc()))
+    finally:
+        # the worker processes and the shared memory of the evaluation pool (see Evaluation-Workers) are freed here,
+        # since the exit of a child process skips the finalizers, and without being stopped halfway
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if getattr(problem_instance, "evaluation_pool", None) is not None:
+            problem_instance.set_evaluation_workers(None)
+        connection.close()
+
+
+def _exit(signum, frame):
+    sys.exit(1)
+
+
+# error of an island sent to the driver, as strings so it can always be pickled
+_IslandError = namedtuple("_IslandError", ["name", "message", "traceback"])
+
+
+def _receive(connection):
+    """
+    Receives a message from the other end of the connection, raising a RuntimeError with the traceback of the island if
+    it is an error
+    """
+    try:
+        message = connection.recv()
+    except EOFError:
+        raise RuntimeError("Island exited without sending its results") from None
+
+    if isinstance(message, _IslandError):
+        raise RuntimeError("Island failed with {}: {}\n\nIsland traceback:\n{}".format(*message))
+    return message
+
+
+# -------------------------------------------------------------------------------------------------
+# Island Model
+# -------------------------------------------------------------------------------------------------
+class IslandModel:
+    """
+    Island model of the genetic algorithm: Islands populations (of Population-Size solutions each) evolve with the
+    GeneticAlgorithm params in separate processes, so a single configuration uses several cores. Every
+    Migration-Interval generations each island sends copies of its Migration-Size fittest solutions to its neighbours
+    in the Topology ("Ring" or "Complete", see topologies), where they replace the least fit solutions (if fitter).
+
+    The islands communicate with this process through pipes, which routes the migrants, so the migrations are
+    synchronous. Island i is seeded with (seed + i), for reproducible runs.
+    """
+    # Constructor
+    # ---------------------------------------------------------------------------------------------
+    def __init__(self, problem_instance, params=default_params, run=0, log_name="temp", log_dir="./log/", seed=None):
+        self._problem_instance  = problem_instance
+        self._run               = run
+        self._log_name          = log_name
+        self._log_dir           = log_dir
+        self._seed              = seed
+        self._best_solution     = None
+        self._history           = []
+
+        self._parse_params(params)
+
+    # search
+    # ---------------------------------------------------------------------------------------------
+    def search(self):
+        """
+        Runs the islands and returns the best solution found by any of them
+        """
+        n_islands = self._n_islands
+
+        # generations of each epoch (between migrations)
+        n_epochs = max(1, math.ceil(self._number_of_generations / self._migration_interval))
+        epochs = [self._migration_interval] * (n_epochs - 1)
+        epochs.append(self._number_of_generations - sum(epochs))
+
+        seed = self._seed
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+
+        connections = []
+        processes = []
+        for island in range(n_islands):
+            connection, island_connection = Pipe()
+            process = Process(
+                target=_island,
+                args=(island_connection, self._problem_instance, self._params, epochs, self._migration_size,
+                      seed + island, self._run, self._log_name, self._log_dir)
+            )
+            process.start()
+            island_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        results = None
+        try:
+            destinations = topologies[self._topology](n_islands)
+            for _ in range(n_epochs - 1):
+                emigrants = [_receive(connection) for connection in connections]
+
+                immigrants = [[] for _ in range(n_islands)]
+                for island, solutions in enumerate(emigrants):
+                    for destination in destinations[island]:
+                        immigrants[destination].extend(solutions)
+
+                for connection, solutions in zip(connections, immigrants):
+                    connection.send(solutions)
+
+            results = [_receive(connection) for connection in connections]
+        finally:
+            # the islands are not daemons (so they can start their own evaluation pools): the ones still running after
+            # an error are stopped
+            for process in processes:
+                if results is None:
+                    process.terminate()
+                process.join()
+
+        self._history = [history for _, history in results]
+        for solution, _ in results:
+            self.find_best_solution(solution)
+
+        return self._best_solution
+
+    def find_best_solution(self, solution):
+        if self._best_solution is None:
+            self._best_solution = solution
+        elif self._problem_instance.objective == ProblemObjective.Minimization:
+            if solution.fitness < self._best_solution.fitness:
+                self._best_solution = solution
+        elif self._problem_instance.objective == ProblemObjective.Maximization:
+            if solution.fitness > self._best_solution.fitness:
+                self._best_solution = solution
+        else:
+            print('The code does not handle multiobjective problems yet.')
+            exit(code=1)
+
+    @property
+    def best_solution(self):
+        return self._best_solution
+
+    @property
+    def history(self):
+        """
+        Fitness of the fittest solution of each generation (from 0), for each island
+        """
+        return self._history
+
+    # initialize
+    # ---------------------------------------------------------------------------------------------
+    def _parse_params(self, params):
+        self._params = params
+
+        self._n_islands = os.cpu_count() or 1
+        if "Islands" in params:
+            self._n_islands = params["Islands"]
+
+        self._number_of_generations = 5
+        if "Number-of-Generations" in params:
+            self._number_of_generations = params["Number-of-Generations"]
+
+        self._migration_interval = 10
+        if "Migration-Interval" in params:
+            self._migration_interval = params["Migration-Interval"]
+
+        self._migration_size = 1
+        if "Migration-Size" in params:
+            self._migration_size = params["Migration-Size"]
+
+        self._topology = "Ring"
+        if "Topology" in params:
+            self._topology = params["Topology"]
+        if self._topology not in topologies:
+            raise ValueError("Unknown Topology {}, use one of: {}".format(self._topology, ", ".join(topologies)))
@@ -3,10 +3,16 @@ import logging
 import random
 import os
 
-from dssg_challenge import compute_cost, utils
+import numpy as np
+
+from dssg_challenge import CostEngine, utils
 from dssg_challenge.ga.problem.problem_template import ProblemTemplate
 from dssg_challenge.ga.problem.objective import ProblemObjective
-from dssg_challenge.ga.problem.solution import LinearSolution
+from dssg_challenge.ga.problem.fidelity import FitnessFidelity
+from dssg_challenge.ga.util.cache import FitnessCache
+from dssg_challenge.ga.util.fitness_store import FitnessStore
+from dssg_challenge.ga.util.evaluation_pool import EvaluationPool
+from dssg_challenge.ga.problem.solution import KeyboardSolution
 from dssg_challenge.ga.algorithm.hill_climbing import HillClimbing
 from dssg_challenge.ga.algorithm.ga_operators import swap_mutation, insert_mutation, inversion_mutation, scramble_mutation
 
@@ -62,12 +68,42 @@ class AlsKeyboardProblem(ProblemTemplate):
         if "Valid_keys" in decision_variables:
             self._valid_keys = decision_variables["Valid_keys"]
 
+        # bigram tables of the corpus, computed once for every evaluation (the corpus can also be a compiled corpus,
+        # see compile_corpus.load_corpus, with its precomputed bigrams)
+        bigrams = None
+        if "Bigrams" in decision_variables:
+            bigrams = decision_variables["Bigrams"]
+
+        self._cost_engine = CostEngine(self._corpus, self._valid_keys, bigrams=bigrams)
+        self._dist_matrix = utils.compute_distance_matrix(encoding_rule["Size"])
+
+        # cache of exact fitness values, keyed by the canonical layout (see set_fitness_cache and canonical_key)
+        self._fitness_cache = FitnessCache()
+        self._fitness_store = None
+
+        # process pool for the exact evaluation of batches of layouts (see set_evaluation_workers), disabled by default
+        self._evaluation_pool = None
+
+        # symmetric transition weights for delta evaluation, with an extra (zero) row/column for blank cells
+        n_keys = len(self._valid_keys) + 1
+        self._swap_weights = np.zeros((n_keys + 1, n_keys + 1))
+        self._swap_weights[:n_keys, :n_keys] = self._cost_engine.bigrams + self._cost_engine.bigrams.T
+        np.fill_diagonal(self._swap_weights, 0)
+        self._swap_cache = None
+
+        # fitness estimator (see set_estimator), disabled by default
+        self._sample_size = None
+        self._sample_seed = None
+        self._window_size = 64
+
         # optimize the access to the constraints
         self._exaustive = True
         if "Exaustiveness" in constraints:
             assert constraints["Exaustiveness"]
 
-        # update encoding_rule given decision variables to pass to Parent's constructor
+        # update encoding_rule given decision variables to pass to Parent's constructor (on a copy, as the default rule
+        # is shared by every instance)
+        encoding_rule = dict(encoding_rule)
         encoding_rule["Data"] = decision_variables["Valid_keys"] + "_"
 
         # call the Parent-class constructor
@@ -93,21 +129,19 @@ class AlsKeyboardProblem(ProblemTemplate):
         if method == 'Random':
 
             # Creates a list of characters with the correct number of characters and at least one of each of the valid characters
-            solution_representation = list(self._valid_keys) + \
-                random.choices(self._encoding.encoding_data, k=(self._encoding.size - len(self._valid_keys)))
-            random.shuffle(solution_representation)  # shuffles the string characters
-
-            solution = LinearSolution(
-                representation=solution_representation,
-                encoding_rule=self._encoding_rule
-            )
+            genome = list(range(len(self._valid_keys))) + \
+                random.choices(range(len(self._encoding.encoding_data)), k=(self._encoding.size - len(self._valid_keys)))
+            random.shuffle(genome)  # shuffles the keys
+
+            solution = KeyboardSolution(genome, self._encoding)
             return solution
 
         elif method == "Heuristic":
-            initial_solution = LinearSolution(
-                representation=list('EINOA TCGVDURL<^SWH_Z__XJQFPBMY,#.0K?'),
-                encoding_rule=self._encoding_rule
-            )
+            heuristic_layout = 'EINOA TCGVDURL<^SWH_Z__XJQFPBMY,#.0K?'
+            if not set(heuristic_layout) <= set(self._encoding.encoding_data):
+                raise Exception("Initial solution not valid given valid keys passed.")
+
+            initial_solution = KeyboardSolution(self._encoding.encode(heuristic_layout), self._encoding)
             if not self.is_admissible(initial_solution):
                 raise Exception("Initial solution not valid given valid keys passed.")
 
@@ -141,6 +175,12 @@ class AlsKeyboardProblem(ProblemTemplate):
             - the set of valid characters has every character from the solution
         If all these conditions are true, the solution is admissible and it returns True.
         """
+        if isinstance(solution, KeyboardSolution) and not debug:
+            genome = solution.genome
+            n_keys = len(self._valid_keys)
+            return len(genome) == self._encoding.size and genome.max() <= n_keys and \
+                np.bincount(genome, minlength=n_keys + 1)[:n_keys].all()
+
         try:
             utils.check_keyboard(solution.representation, self._valid_keys, self._encoding.size)
         except AssertionError as e:
@@ -150,19 +190,386 @@ class AlsKeyboardProblem(ProblemTemplate):
         else:
             return True
 
+    def admissible_layouts(self, layouts):
+        """
+        Checks the admissibility of each row of an (N, Size) matrix of integer coded layouts at once (see encode),
+        returning a boolean vector: the layouts must have every valid character and only valid characters or blanks
+        """
+        layouts = np.asarray(layouts)
+        n_keys = len(self._valid_keys)
+        if layouts.shape[1] != self._encoding.size:
+            return np.zeros(len(layouts), dtype=bool)
+
+        offsets = np.arange(len(layouts))[:, None] * (n_keys + 1)
+        counts = np.bincount((np.minimum(layouts, n_keys) + offsets).ravel(), minlength=len(layouts) * (n_keys + 1))
+        counts = counts.reshape(len(layouts), n_keys + 1)
+
+        return counts[:, :n_keys].all(axis=1) & (layouts.max(axis=1) <= n_keys)
+
     # Evaluate_solution()
     #-------------------------------------------------------------------------------------------------------------
-    def evaluate_solution(self, solution, feedback=None):
+    def evaluate_solution(self, solution, feedback=None, sample_size=None):
         """
-        Evaluates the solution provided
+        Evaluates the solution provided. With a sample size (given here or with set_estimator) the fitness is estimated
+        from a stratified sample of windows of the corpus, and its standard error is stored in solution.fitness_stderr.
         """
         rep = solution.representation
-        fitness = compute_cost(rep, self._corpus)
+
+        if sample_size is None:
+            sample_size = self._sample_size
+
+        if sample_size:
+            fitness, stderr = self._cost_engine.estimate(rep, sample_size, self._window_size, self._sample_seed)
+            fidelity = FitnessFidelity.Sample
+        else:
+            fitness, stderr = self.evaluate_population(self._layout(solution)[None])[0], 0
+            fidelity = FitnessFidelity.Exact
+
+        solution._fitness = fitness
+        solution._fitness_stderr = stderr
+        solution._fitness_fidelity = fidelity
+        solution._is_fitness_calculated = True
+
+        return solution
+
+    # Evaluate_solutions() / evaluate_population()
+    #-------------------------------------------------------------------------------------------------------------
+    def evaluate_solutions(self, solutions, feedback=None, sample_sizes=None):
+        """
+        Evaluates a list of solutions at once (see evaluate_population). sample_sizes optionally gives the sample size
+        of each solution (e.g. growing with its fitness rank), see evaluate_solution.
+        """
+        if len(solutions) == 0:
+            return solutions
+
+        if sample_sizes is not None or self._sample_size:
+            if sample_sizes is None:
+                sample_sizes = [self._sample_size] * len(solutions)
+            for solution, sample_size in zip(solutions, sample_sizes):
+                self.evaluate_solution(solution, sample_size=sample_size or 0)
+            return solutions
+
+        fitness = self.evaluate_population(np.array([self._layout(s) for s in solutions]))
+
+        for solution, value in zip(solutions, fitness):
+            solution._fitness = value
+            solution._fitness_stderr = 0
+            solution._fitness_fidelity = FitnessFidelity.Exact
+            solution._is_fitness_calculated = True
+
+        return solutions
+
+    # Screen_solutions() / refine_solutions()
+    #-------------------------------------------------------------------------------------------------------------
+    def screen_solutions(self, solutions, feedback=None):
+        """
+        Cheap evaluation of a list of solutions: the sample estimate when the estimator is on (see set_estimator),
+        otherwise the bigram lower bound (CostEngine.batch_lower_bound), which is exact for layouts without duplicate
+        keys. The fidelity of each fitness is stored in solution.fitness_fidelity.
+        """
+        if self._sample_size or len(solutions) == 0:
+            return self.evaluate_solutions(solutions, feedback=feedback)
+
+        layouts = np.array([self._layout(s) for s in solutions])
+        fitness = self._cost_engine.batch_lower_bound(layouts)
+
+        n_keys = len(self._valid_keys)
+        counts = np.zeros((len(layouts), n_keys + 1), dtype=int)
+        np.add.at(counts, (np.arange(len(layouts))[:, None], layouts), 1)
+        exact = (counts[:, :n_keys] <= 1).all(axis=1)
+
+        # layouts already evaluated exactly get their exact fitness for free
+        cache = self._fitness_cache
+        if cache is not None:
+            for n, layout in enumerate(utils.canonicalize(layouts)):
+                key = layout.tobytes()
+                if not exact[n] and key in cache:
+                    fitness[n], exact[n] = cache.get(key), True
+
+        for solution, value, is_exact in zip(solutions, fitness, exact):
+            solution._fitness = value
+            solution._fitness_stderr = 0
+            solution._fitness_fidelity = FitnessFidelity.Exact if is_exact else FitnessFidelity.Bound
+            solution._is_fitness_calculated = True
+
+        return solutions
+
+    def refine_solutions(self, solutions, feedback=None):
+        """
+        Evaluates exactly the solutions whose fitness is not exact yet
+        """
+        pending = [s for s in solutions if s.fitness_fidelity != FitnessFidelity.Exact]
+
+        sample_size = self._sample_size
+        self._sample_size = None
+        try:
+            self.evaluate_solutions(pending, feedback=feedback)
+        finally:
+            self._sample_size = sample_size
+
+        return solutions
+
+    def evaluate_population(self, layouts):
+        """
+        Evaluates an (N, Size) matrix of integer coded layouts (see encode), returning the vector with the N costs.
+        Only the layouts missing from the fitness cache and from the fitness store are evaluated.
+        """
+        cache, store = self._fitness_cache, self._fitness_store
+        if cache is None and store is None:
+            return self._batch_cost(layouts)
+
+        # symmetric copies of a layout share their key (see canonical_key)
+        keys = [layout.tobytes() for layout in utils.canonicalize(layouts)]
+        if cache is not None:
+            fitness = np.array([cache.get(key, np.nan) for key in keys])
+        else:
+            fitness = np.full(len(keys), np.nan)
+
+        # repeated layouts within the batch are evaluated once
+        missing = {}
+        for n in np.flatnonzero(np.isnan(fitness)):
+            missing.setdefault(keys[n], []).append(n)
+
+        if missing and store is not None:
+            for key, value in store.get_many(list(missing)).items():
+                fitness[missing.pop(key)] = value
+                if cache is not None:
+                    cache.put(key, value)
+
+        if missing:
+            first = [rows[0] for rows in missing.values()]
+            for (key, rows), value in zip(missing.items(), self._batch_cost(np.asarray(layouts)[first])):
+                fitness[rows] = value
+                if cache is not None:
+                    cache.put(key, value)
+                if store is not None:
+                    store.put(key, value)
+
+        return fitness
+
+    def _batch_cost(self, layouts):
+        if self._evaluation_pool is not None:
+            return self._evaluation_pool.batch_cost(layouts)
+        return self._cost_engine.batch_cost(layouts)
+
+    # Fitness cache - set_fitness_cache()
+    #-------------------------------------------------------------------------------------------------------------
+    def set_fitness_cache(self, max_size=10000):
+        """
+        Replaces the fitness cache by an empty one holding up to max_size layouts (None or 0 disables the cache)
+        """
+        self._fitness_cache = FitnessCache(max_size) if max_size else None
+
+    # Fitness store - set_fitness_store()
+    #-------------------------------------------------------------------------------------------------------------
+    def set_fitness_store(self, path, batch_size=256):
+        """
+        Shares exact fitness values with other processes and runs through the SQLite file at path (None disables it),
+        see FitnessStore. The values are keyed by the fingerprint of the corpus, so one file can serve several corpora.
+        """
+        if self._fitness_store is not None:
+            self._fitness_store.close()
+
+        self._fitness_store = None
+        if path is not None:
+            self._fitness_store = FitnessStore(path, self._cost_engine.fingerprint, batch_size=batch_size)
+
+    @property
+    def fitness_store(self):
+        return self._fitness_store
+
+    # Evaluation workers - set_evaluation_workers()
+    #-------------------------------------------------------------------------------------------------------------
+    def set_evaluation_workers(self, n_workers):
+        """
+        Evaluates the batches of layouts (see evaluate_population) in a persistent pool of n_workers processes sharing
+        the corpus tables, see EvaluationPool (None, 0 or 1 evaluates them in this process). The pool is kept if it
+        already has n_workers processes.
+        """
+        if self._evaluation_pool is not None:
+            if self._evaluation_pool.n_workers == n_workers:
+                return
+            self._evaluation_pool.close()
+
+        self._evaluation_pool = None
+        if n_workers is not None and n_workers > 1:
+            self._evaluation_pool = EvaluationPool(self._cost_engine, n_workers)
+
+    @property
+    def evaluation_pool(self):
+        return self._evaluation_pool
+
+    @property
+    def fitness_cache(self):
+        """
+        The fitness cache (see FitnessCache.stats for its counters), None when disabled
+        """
+        return self._fitness_cache
+
+    # Fitness estimator - set_estimator()
+    #-------------------------------------------------------------------------------------------------------------
+    def set_estimator(self, sample_size=None, seed=None, window_size=64):
+        """
+        Makes the following evaluations estimate the fitness from sample_size windows of window_size characters of
+        the corpus (None or 0 to go back to the exact fitness). Evaluations with the same seed share the same windows,
+        so their estimates can be compared with each other.
+        """
+        self._sample_size = sample_size
+        self._sample_seed = seed
+        self._window_size = window_size
+
+    @property
+    def sample_size(self):
+        return self._sample_size
+
+    # Integer coding of layouts - encode() / decode()
+    #-------------------------------------------------------------------------------------------------------------
+    def encode(self, representation):
+        """
+        Integer coding of a layout: the index of each key in the encoding data (valid keys + "_")
+        """
+        return self._cost_engine.encode_layout(representation)
+
+    def decode(self, layout):
+        """
+        Layout (list of keys) of an integer coded layout
+        """
+        return [self._encoding.encoding_data[key] for key in layout]
+
+    def _layout(self, solution):
+        # the genome of a KeyboardSolution already is the integer coded layout
+        if isinstance(solution, KeyboardSolution):
+            return solution.genome
+        return self.encode(solution.representation)
+
+    # Canonical_key()
+    #-------------------------------------------------------------------------------------------------------------
+    def canonical_key(self, solution):
+        """
+        The integer coded layout in its canonical orientation (see utils.canonicalize), as bytes: the 12 rotations and
+        reflections of a keyboard have the same cost, so they share the key
+        """
+        return utils.canonicalize(self._layout(solution)).tobytes()
+
+    def canonical_layouts(self, layouts):
+        """
+        Canonical orientation of each row of an (N, Size) matrix of integer coded layouts (see canonical_key)
+        """
+        return utils.canonicalize(layouts)
+
+    # Delta evaluation of swap moves - delta_swap(), swap_deltas(), commit_swap()
+    #-------------------------------------------------------------------------------------------------------------
+    def delta_swap(self, solution, i, j):
+        """
+        Returns the change in fitness caused by swapping the keys in cells i and j of the solution, without changing
+        or evaluating it.
+
+        For layouts without duplicate keys the cost is a quadratic assignment over the bigram counts, so the delta is
+        read from the cached cost of placing each key in each cell. The cache is built for the last solution passed and
+        is kept up to date by commit_swap(). Layouts with duplicate keys are evaluated in full.
+        """
+        state = self._swap_state(solution)
+
+        if state is None:
+            swapped = self._layout(solution).copy()
+            swapped[[i, j]] = swapped[[j, i]]
+            return self.evaluate_population(swapped[None])[0] - self._current_fitness(solution)
+
+        keys, gain = state["keys"], state["gain"]
+        x, y = keys[i], keys[j]
+
+        return gain[j, x] - gain[i, x] + gain[i, y] - gain[j, y] + 2 * self._swap_weights[x, y] * self._dist_matrix[i, j]
+
+    def swap_deltas(self, solution):
+        """
+        Returns the matrix with the change in fitness of every swap of two cells of the solution (the 2-swap
+        neighborhood), see delta_swap().
+        """
+        state = self._swap_state(solution)
+        size = len(self._layout(solution))
+
+        if state is None:
+            deltas = np.zeros((size, size))
+            for i in range(size):
+                for j in range(i + 1, size):
+                    deltas[i, j] = deltas[j, i] = self.delta_swap(solution, i, j)
+            return deltas
+
+        keys = state["keys"]
+        placed = state["gain"][:, keys]  # placed[c, i]: cost of placing the key of cell i in cell c
+        own = np.diag(placed)
+
+        deltas = placed + placed.T - own[:, None] - own[None, :] + \
+            2 * self._swap_weights[np.ix_(keys, keys)] * self._dist_matrix
+        np.fill_diagonal(deltas, 0)
+
+        return deltas
+
+    def commit_swap(self, solution, i, j):
+        """
+        Swaps the keys in cells i and j of the solution (in place), updating its fitness and the delta evaluation
+        cache. Returns the solution.
+        """
+        delta = self.delta_swap(solution, i, j)
+        fitness = self._current_fitness(solution) + delta
+
+        if isinstance(solution, KeyboardSolution):
+            solution.genome[[i, j]] = solution.genome[[j, i]]
+        else:
+            rep = solution.representation
+            rep[i], rep[j] = rep[j], rep[i]
+
+        state = self._swap_cache
+        if state is not None and state["solution"] is solution and state["keys"] is not None:
+            keys, weights = state["keys"], self._swap_weights
+            x, y = keys[i], keys[j]
+            state["gain"] += np.outer(self._dist_matrix[:, j] - self._dist_matrix[:, i], weights[x] - weights[y])
+            keys[i], keys[j] = y, x
+            state["representation"] = self._layout(solution).tobytes()
+
         solution._fitness = fitness
         solution._is_fitness_calculated = True
 
         return solution
 
+    def _swap_state(self, solution):
+        """
+        Builds (or reuses) the delta evaluation cache of the solution. Returns None if the layout has duplicate or
+        missing keys.
+        """
+        layout = self._layout(solution)
+        representation = layout.tobytes()
+        state = self._swap_cache
+
+        if state is None or state["solution"] is not solution or state["representation"] != representation:
+            blank = len(self._swap_weights) - 1
+            keys = np.where(layout < len(self._valid_keys), layout, blank).astype(int)
+
+            counts = np.bincount(keys, minlength=blank + 1)[:blank - 1]
+            if (counts != 1).any():
+                keys = gain = None
+            else:
+                cells = np.zeros(blank + 1, dtype=int)
+                cells[keys] = np.arange(len(keys))
+                cells[blank - 1] = 0  # start token: the cursor begins in the central cell
+                gain = self._dist_matrix[:, cells] @ self._swap_weights
+
+            state = self._swap_cache = {
+                "solution": solution,
+                "representation": representation,
+                "keys": keys,
+                "gain": gain
+            }
+
+        if state["keys"] is None:
+            return None
+        return state
+
+    def _current_fitness(self, solution):
+        if not solution._is_fitness_calculated:
+            self.evaluate_solution(solution)
+        return solution.fitness
+
     @property
     def corpus(self):
         return self._corpus
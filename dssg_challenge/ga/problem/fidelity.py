@@ -0,0 +1,7 @@
+class FitnessFidelity:
+    """
+    The fidelity of a fitness value: Exact, a lower Bound (cheap screening) or a Sample estimate (with its standard error)
+    """
+    Exact   = "Exact"
+    Bound   = "Bound"
+    Sample  = "Sample"
@@ -1,4 +1,31 @@
+import numpy as np
+
 from dssg_challenge.ga.problem.objective import ProblemObjective
+from dssg_challenge.ga.problem.fidelity import FitnessFidelity
+from dssg_challenge.ga.problem.solution import KeyboardSolution
+
+# -------------------------------------------------------------------------------------------------
+# Diversity of a population
+# -------------------------------------------------------------------------------------------------
+def _diversity(representations):
+    """
+    Fraction of the positions where two solutions of the population (drawn with replacement) differ, on average: for
+    each position, 1 minus the sum of the squared frequencies of its values. 0 when all the solutions are equal.
+    """
+    representations = np.asarray(representations)
+    if representations.size == 0:
+        return 0.0
+
+    n_solutions, size = representations.shape
+    _, codes = np.unique(representations, return_inverse=True)
+    codes = codes.reshape(n_solutions, size)
+    n_values = codes.max() + 1
+
+    counts = np.bincount((codes + np.arange(size) * n_values).ravel(), minlength=size * n_values)
+    frequencies = counts.reshape(size, n_values) / n_solutions
+
+    return float(1 - (frequencies ** 2).sum(axis=1).mean())
+
 
 # -------------------------------------------------------------------------------------------------
 # Population Class
@@ -35,6 +62,19 @@ class Population:
         self.sort()
         self._list[ 0 ] = solution
 
+    def replace(self, index, solution):
+        """
+        Puts the solution in place of the solution at the index
+        """
+        self._list[index] = solution
+
+    def top(self, k):
+        """
+        Indexes of the k fittest solutions, the fittest first (the population is sorted first)
+        """
+        self.sort()
+        return list(range(len(self._list) - 1, max(len(self._list) - k, 0) - 1, -1))
+
     @property
     def size(self):
         return len(self._list)
@@ -67,6 +107,20 @@ class Population:
         """
         return self._list
 
+    @property
+    def fitness(self):
+        """
+        Fitness vector (of the population), in the order of the solution list
+        """
+        return np.array([solution.fitness for solution in self._list], dtype=np.float64)
+
+    @property
+    def diversity(self):
+        """
+        Diversity of the representations of the population, from 0 (all equal) to 1 (see _diversity)
+        """
+        return _diversity([list(solution.representation) for solution in self._list])
+
     # 
     def sort(self):
         """
@@ -98,4 +152,263 @@ class Population:
             exit(code=1)
 
 
-        self._sorted = True
\ No newline at end of file
+        self._sorted = True
+
+# -------------------------------------------------------------------------------------------------
+# Array Population Class
+# -------------------------------------------------------------------------------------------------
+class ArrayPopulation:
+    """
+    Population stored as a structure of arrays: an (N, Size) uint8 matrix with the genome of each solution (see
+    KeyboardSolution) and vectors with their fitness, standard error and fidelity.
+
+    The solutions are RowSolution views of the rows, so operators and evaluations that change them change the
+    matrix and vectors in place. The order of the solutions (least fit first, as in Population) is an argsort of the
+    fitness vector, cached until a fitness value changes or a solution is added.
+    """
+    # ---------------------------------------------------------------------------------------------
+    def __init__(self, problem, maximum_size, genomes=None, fitness=None):
+        self._problem   = problem
+        self._objective = problem.objective
+        self._max_size  = maximum_size
+        self._encoding  = problem.encoding
+
+        self._genomes   = np.zeros((maximum_size, self._encoding.size), dtype=np.uint8)
+        self._fitness   = np.zeros(maximum_size)
+        self._stderr    = np.zeros(maximum_size)
+        self._fidelity  = np.full(maximum_size, FitnessFidelity.Exact, dtype=object)
+        self._evaluated = np.zeros(maximum_size, dtype=bool)
+        self._size      = 0
+        self._order     = None
+        self._solutions = []
+
+        if genomes is not None:
+            self.add_genomes(genomes, fitness)
+
+    @classmethod
+    def from_solutions(cls, problem, maximum_size, solution_list):
+        """
+        Array population with a copy of each solution of the list
+        """
+        population = cls(problem, maximum_size)
+        for solution in solution_list:
+            population.add(solution)
+        return population
+
+    # ---------------------------------------------------------------------------------------------
+    @property
+    def genomes(self):
+        """
+        (N, Size) view of the genome matrix
+        """
+        return self._genomes[:self._size]
+
+    @property
+    def fitness(self):
+        """
+        Read-only view of the fitness vector (see set_fitness)
+        """
+        fitness = self._fitness[:self._size]
+        fitness.flags.writeable = False
+        return fitness
+
+    @property
+    def diversity(self):
+        """
+        Diversity of the genomes of the population, from 0 (all equal) to 1 (see _diversity)
+        """
+        return _diversity(self.genomes)
+
+    def set_fitness(self, fitness, stderr=0, fidelity=FitnessFidelity.Exact):
+        """
+        Sets the fitness of every solution at once (e.g. from problem.evaluate_population(population.genomes))
+        """
+        self._fitness[:self._size] = fitness
+        self._stderr[:self._size] = stderr
+        self._fidelity[:self._size] = fidelity
+        self._evaluated[:self._size] = True
+        self._order = None
+
+    # ---------------------------------------------------------------------------------------------
+    @property
+    def order(self):
+        """
+        Indexes of the solutions from the least fit to the fittest (cached)
+        """
+        if self._order is None:
+            fitness = self._fitness[:self._size]
+            if self._objective == ProblemObjective.Minimization:
+                fitness = -fitness
+            elif self._objective != ProblemObjective.Maximization:
+                print('The code does not handle multiobjective problems yet.')
+                exit(code=1)
+            self._order = np.argsort(fitness, kind='stable')
+        return self._order
+
+    def top(self, k):
+        """
+        Indexes of the k fittest solutions, the fittest first
+        """
+        return self.order[::-1][:k]
+
+    @property
+    def fittest(self):
+        if self._size > 0:
+            return self._solutions[self.order[-1]]
+        return None
+
+    @property
+    def least_fit(self):
+        if self._size > 0:
+            return self._solutions[self.order[0]]
+        return None
+
+    def replace_leastfit(self, solution):
+        self._set_row(self.order[0], solution)
+
+    def replace(self, index, solution):
+        """
+        Copies the genome and fitness of the solution into the row at the index
+        """
+        self._set_row(index, solution)
+
+    # ---------------------------------------------------------------------------------------------
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def has_space(self):
+        return self._size < self._max_size
+
+    @property
+    def is_full(self):
+        return self._size >= self._max_size
+
+    def add(self, solution):
+        """
+        Copies the genome and fitness of the solution into a new row
+        """
+        self._solutions.append(RowSolution(self, self._size))
+        self._size += 1
+        self._set_row(self._size - 1, solution)
+
+    def add_genomes(self, genomes, fitness=None):
+        """
+        Adds a matrix of genomes (not evaluated, unless their fitness is given)
+        """
+        genomes = np.asarray(genomes, dtype=np.uint8)
+        rows = slice(self._size, self._size + len(genomes))
+
+        self._genomes[rows] = genomes
+        self._evaluated[rows] = fitness is not None
+        if fitness is not None:
+            self._fitness[rows] = fitness
+            self._stderr[rows] = 0
+            self._fidelity[rows] = FitnessFidelity.Exact
+
+        self._solutions.extend(RowSolution(self, row) for row in range(rows.start, rows.stop))
+        self._size = rows.stop
+        self._order = None
+
+    def _set_row(self, row, solution):
+        self._genomes[row] = solution.genome
+        self._fitness[row] = solution.fitness
+        self._stderr[row] = solution.fitness_stderr
+        self._fidelity[row] = solution.fitness_fidelity
+        self._evaluated[row] = solution._is_fitness_calculated
+        self._order = None
+
+    def get(self, index):
+        """
+        It returns a solution of the population according to the index
+        """
+        if (index >= 0) and (index < self._size):
+            return self._solutions[index]
+        else:
+            return None
+
+    @property
+    def solutions(self):
+        """
+        Solution list (of the population): RowSolution views of the rows
+        """
+        return self._solutions
+
+    def sort(self):
+        """
+        Computes the order of the solutions (the rows themselves are not moved, see order)
+        """
+        return self.order
+
+
+# -------------------------------------------------------------------------------------------------
+# Row Solution Class
+# -------------------------------------------------------------------------------------------------
+class RowSolution(KeyboardSolution):
+    """
+    KeyboardSolution whose genome and fitness live in a row of an ArrayPopulation
+    """
+    __slots__ = ("_population", "_row")
+
+    def __init__(self, population, row):
+        self._population    = population
+        self._row           = row
+        self._id            = [0, row]
+        self._view          = None
+
+    def clone(self):
+        """
+        Detached copy of the solution (a KeyboardSolution)
+        """
+        clone = KeyboardSolution(self._genome.copy(), self._encoding, self._id)
+        clone._fitness               = self._fitness
+        clone._fitness_stderr        = self._fitness_stderr
+        clone._fitness_fidelity      = self._fitness_fidelity
+        clone._is_fitness_calculated = self._is_fitness_calculated
+        return clone
+
+    @property
+    def _genome(self):
+        return self._population._genomes[self._row]
+
+    @_genome.setter
+    def _genome(self, genome):
+        self._population._genomes[self._row] = genome
+
+    @property
+    def _encoding(self):
+        return self._population._encoding
+
+    @property
+    def _fitness(self):
+        return self._population._fitness[self._row]
+
+    @_fitness.setter
+    def _fitness(self, fitness):
+        self._population._fitness[self._row] = fitness
+        self._population._order = None
+
+    @property
+    def _fitness_stderr(self):
+        return self._population._stderr[self._row]
+
+    @_fitness_stderr.setter
+    def _fitness_stderr(self, stderr):
+        self._population._stderr[self._row] = stderr
+
+    @property
+    def _fitness_fidelity(self):
+        return self._population._fidelity[self._row]
+
+    @_fitness_fidelity.setter
+    def _fitness_fidelity(self, fidelity):
+        self._population._fidelity[self._row] = fidelity
+
+    @property
+    def _is_fitness_calculated(self):
+        return bool(self._population._evaluated[self._row])
+
+    @_is_fitness_calculated.setter
+    def _is_fitness_calculated(self, evaluated):
+        self._population._evaluated[self._row] = evaluated
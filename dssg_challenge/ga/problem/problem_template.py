@@ -21,6 +21,7 @@ from random import choice
 from copy import deepcopy
 from dssg_challenge.ga.problem.solution import LinearSolution, Encoding
 from dssg_challenge.ga.problem.objective import ProblemObjective
+from dssg_challenge.ga.problem.fidelity import FitnessFidelity
 
 #──────────────────────────────────────────────────────────────────────────────────────────────────────────────────
 # Class: Problem Template Base Class (Super-class)
@@ -122,6 +123,46 @@ class ProblemTemplate:
         print(" is_admissible - It is an abstract method! Must be extended / implemented in the child class")
         pass
 
+    # Evaluate_solutions()
+    #-------------------------------------------------------------------------------------------------------------
+    def evaluate_solutions(self, solutions, feedback = None):
+        """
+        Evaluates a list of solutions (e.g. a whole generation), storing the fitness in each of them. Problems that can
+        evaluate several solutions at once should override it.
+        """
+        for solution in solutions:
+            self.evaluate_solution(solution, feedback = feedback)
+
+        return solutions
+
+    # Screen_solutions() / refine_solutions()
+    #-------------------------------------------------------------------------------------------------------------
+    def screen_solutions(self, solutions, feedback = None):
+        """
+        Evaluates a list of solutions with the cheapest fitness available, recording its fidelity in each solution (see
+        FitnessFidelity). Problems without a cheaper approximation evaluate them exactly.
+        """
+        return self.evaluate_solutions(solutions, feedback = feedback)
+
+    def refine_solutions(self, solutions, feedback = None):
+        """
+        Evaluates exactly the solutions whose fitness is not exact yet
+        """
+        for solution in solutions:
+            if solution.fitness_fidelity != FitnessFidelity.Exact:
+                self.evaluate_solution(solution, feedback = feedback)
+
+        return solutions
+
+    # Canonical_key()
+    #-------------------------------------------------------------------------------------------------------------
+    def canonical_key(self, solution):
+        """
+        Hashable key shared by all the solutions that are equivalent to this one (used to detect duplicates). Problems
+        with symmetric solutions should override it.
+        """
+        return tuple(solution.representation)
+
     # Solution Admissibility Function - is_admissible()
     #-------------------------------------------------------------------------------------------------------------
     ###@property
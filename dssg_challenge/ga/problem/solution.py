@@ -8,6 +8,8 @@ Content:
 
 ▶ class LinearSolution
 
+▶ class KeyboardSolution
+
 ▶ class Encoding
 
 ▶ class EncodingDataType
@@ -23,8 +25,9 @@ Author: Fernando A J Peres - fperes@novaims.unl.pt - (2019) version L4.0
 
 # import
 import numpy as np
-from copy import deepcopy
+from copy import copy, deepcopy
 from dssg_challenge.ga.problem.objective import ProblemObjective
+from dssg_challenge.ga.problem.fidelity import FitnessFidelity
 
 # /\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/
 # C O D E
@@ -44,6 +47,8 @@ class LinearSolution:
         self._representation        = representation
         self._encoding_rule         = encoding_rule
         self._fitness               = 0
+        self._fitness_stderr        = 0
+        self._fitness_fidelity      = FitnessFidelity.Exact
         self._is_fitness_calculated = False
         self._encoding              = Encoding(encoding_rule)
 
@@ -85,11 +90,32 @@ class LinearSolution:
     def fitness(self, fitness):
         self._fitness = fitness
 
+    @property
+    def fitness_stderr(self):
+        """
+        Standard error of the fitness, when it is estimated (0 if it is exact)
+        """
+        return self._fitness_stderr
+
+    @property
+    def fitness_fidelity(self):
+        """
+        How the fitness was computed, see FitnessFidelity
+        """
+        return self._fitness_fidelity
+
     def reset_fitness(self):
         self._fitness = 0
     
-    #def clone(self):
-    #    return deepcopy(self)
+    def clone(self):
+        """
+        Copy of the solution with its own representation (the encoding objects are shared, and the other attributes
+        are copied by reference)
+        """
+        clone = copy(self)
+        clone._id = list(self._id)
+        clone._representation = self._representation.copy()
+        return clone
 
     @property
     def encoding(self):
@@ -99,6 +125,176 @@ class LinearSolution:
         return f"Rep: {self._representation} - Fitness: {self.fitness} " 
 
 
+# -------------------------------------------------------------------------------------------------
+# Class: KeyboardSolution
+# -------------------------------------------------------------------------------------------------
+class KeyboardSolution:
+    """
+    Compact linear solution: a uint8 array with the index of each element in the encoding data (the genome), and the
+    Encoding object of the problem, shared by all its solutions. The representation is a list-like view of the genome
+    (see GenomeView, created on first use and kept until the genome is replaced), so the operators written for
+    LinearSolution work unchanged.
+    """
+    __slots__ = ("_id", "_genome", "_encoding", "_fitness", "_fitness_stderr", "_fitness_fidelity",
+                 "_is_fitness_calculated", "_view")
+
+    # Constructor
+    #----------------------------------------------------------------------------------------------
+    def __init__(self, genome, encoding, id=(0, 0)):
+        self._id                    = list(id)
+        self._genome                = np.asarray(genome, dtype=np.uint8)
+        self._encoding              = encoding
+        self._fitness               = 0
+        self._fitness_stderr        = 0
+        self._fitness_fidelity      = FitnessFidelity.Exact
+        self._is_fitness_calculated = False
+        self._view                  = None
+
+    # clone
+    #----------------------------------------------------------------------------------------------
+    def clone(self):
+        """
+        Copy of the solution, with its own genome (the encoding is shared)
+        """
+        clone = KeyboardSolution.__new__(KeyboardSolution)
+        clone._id                    = list(self._id)
+        clone._genome                = self._genome.copy()
+        clone._encoding              = self._encoding
+        clone._fitness               = self._fitness
+        clone._fitness_stderr        = self._fitness_stderr
+        clone._fitness_fidelity      = self._fitness_fidelity
+        clone._is_fitness_calculated = self._is_fitness_calculated
+        clone._view                  = None
+        return clone
+
+    def __deepcopy__(self, memo):
+        return self.clone()
+
+    @property
+    def id(self):
+        return self._id
+
+    @id.setter
+    def id(self, id):
+        self._id = id
+
+    # genome / representation
+    #----------------------------------------------------------------------------------------------
+    @property
+    def genome(self):
+        return self._genome
+
+    @genome.setter
+    def genome(self, genome):
+        self._genome = np.asarray(genome, dtype=np.uint8)
+        self._view = None
+
+    @property
+    def representation(self):
+        if self._view is None:
+            self._view = GenomeView(self._genome, self._encoding)
+        return self._view
+
+    @representation.setter
+    def representation(self, representation):
+        self._genome = self._encoding.encode(representation)
+        self._view = None
+
+    @property
+    def encoding_rule(self):
+        return self._encoding.encoding_rule
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    # Fitness
+    #----------------------------------------------------------------------------------------------
+    @property
+    def fitness(self):
+        return self._fitness
+
+    @fitness.setter
+    def fitness(self, fitness):
+        self._fitness = fitness
+
+    @property
+    def fitness_stderr(self):
+        """
+        Standard error of the fitness, when it is estimated (0 if it is exact)
+        """
+        return self._fitness_stderr
+
+    @property
+    def fitness_fidelity(self):
+        """
+        How the fitness was computed, see FitnessFidelity
+        """
+        return self._fitness_fidelity
+
+    def reset_fitness(self):
+        self._fitness = 0
+
+    def __str__(self):
+        return f"Rep: {self.representation} - Fitness: {self.fitness} "
+
+
+# -------------------------------------------------------------------------------------------------
+# Class: GenomeView
+# -------------------------------------------------------------------------------------------------
+class GenomeView:
+    """
+    List-like view of the elements of an integer coded genome: reading decodes them and writing encodes them into the
+    genome, in place
+    """
+    __slots__ = ("_genome", "_encoding")
+
+    def __init__(self, genome, encoding):
+        self._genome    = genome
+        self._encoding  = encoding
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._encoding.decode(self._genome[index])
+        return self._encoding.encoding_data[self._genome[index]]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._genome[index] = self._encoding.encode(list(value))
+        else:
+            self._genome[index] = self._encoding.index(value)
+
+    def __len__(self):
+        return len(self._genome)
+
+    def __iter__(self):
+        return iter(self._encoding.decode(self._genome))
+
+    def __contains__(self, element):
+        try:
+            return bool((self._genome == self._encoding.index(element)).any())
+        except ValueError:
+            return False
+
+    def index(self, element):
+        found = np.flatnonzero(self._genome == self._encoding.index(element))
+        if len(found) == 0:
+            raise ValueError(f"{element!r} is not in the solution")
+        return int(found[0])
+
+    def count(self, element):
+        return int((self._genome == self._encoding.index(element)).sum())
+
+    def copy(self):
+        return list(self)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 # -------------------------------------------------------------------------------------------------
 # Class: Encoding Definition
 # -------------------------------------------------------------------------------------------------
@@ -145,6 +341,9 @@ class Encoding():
         if "Precision" in encoding_rule:
             self._precision = encoding_rule["Precision"]
 
+        self._encoding_rule = encoding_rule
+        self._lookup        = None
+
     #----------------------------------------------------------------------------------------------
     @property
     def size(self):
@@ -194,6 +393,41 @@ class Encoding():
     def precision(self):
         return self._precision
 
+    @property
+    def encoding_rule(self):
+        return self._encoding_rule
+
+    # integer coding of the elements: the index of each one in the encoding data
+    # ---------------------------------------------------------------------------------------------
+    def _lookup_tables(self):
+        if self._lookup is None:
+            symbols = list(self._encoding_data)
+            self._lookup = ({symbol: index for index, symbol in enumerate(symbols)}, np.array(symbols, dtype=object))
+        return self._lookup
+
+    def encode(self, elements):
+        """
+        Returns the uint8 array with the index of each element in the encoding data
+        """
+        index, _ = self._lookup_tables()
+        return np.fromiter((index[element] for element in elements), dtype=np.uint8, count=len(elements))
+
+    def decode(self, genome):
+        """
+        Returns the list of elements of an integer coded solution (see encode)
+        """
+        _, symbols = self._lookup_tables()
+        return symbols[genome].tolist()
+
+    def index(self, element):
+        """
+        Index of an element in the encoding data (ValueError if it isn't there)
+        """
+        index, _ = self._lookup_tables()
+        if element not in index:
+            raise ValueError(f"{element!r} is not in the encoding data")
+        return index[element]
+
 # -------------------------------------------------------------------------------------------------
 # Encoding Data Type
 # -------------------------------------------------------------------------------------------------   
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+
+class FitnessCache:
+    """
+        Bounded LRU cache of fitness values, with hit/miss/eviction counters
+    """
+    #
+    #----------------------------------------------------------------------------------------------
+    def __init__(self, max_size=10000):
+        self._max_size  = max_size
+        self._data      = OrderedDict()
+        self.hits       = 0
+        self.misses     = 0
+        self.evictions  = 0
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def get(self, key, default=None):
+        """
+        Returns the cached value of key (marking it as the most recently used), or default on a miss
+        """
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+        self.misses += 1
+        return default
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def stats(self):
+        return {
+            "Size"      : len(self._data),
+            "Hits"      : self.hits,
+            "Misses"    : self.misses,
+            "Evictions" : self.evictions
+        }
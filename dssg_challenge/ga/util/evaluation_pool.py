@@ -0,0 +1,131 @@
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from dssg_challenge import CostEngine
+
+# cost engine of a worker process, built once on the shared tables (see _start_worker)
+_engine = None
+_blocks = []
+
+
+def _start_worker(valid_keys, tables):
+    """
+    Initializer of the worker processes: attaches the shared corpus and bigram tables and builds the cost engine
+    """
+    global _engine
+
+    arrays = {}
+    for name, (block_name, shape, dtype) in tables.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    _engine = CostEngine(arrays["codes"], valid_keys, bigrams=arrays["bigrams"])
+
+
+def _batch_cost(layouts):
+    return _engine.batch_cost(layouts)
+
+
+def _release(executor, blocks):
+    executor.shutdown()
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class EvaluationPool:
+    """
+        Persistent pool of n_workers processes (one per CPU by default) computing the exact cost of layouts with the
+        cost engine of the parent process.
+
+        The encoded corpus and the bigram counts are copied once to shared memory, and each worker builds its own
+        engine on them when it starts (keeping its cache of runs between calls). A batch of layouts is split in
+        chunks_per_worker chunks per worker and the costs come back in the order of the layouts, equal to the ones of
+        CostEngine.batch_cost. Batches smaller than min_batch_size are evaluated in this process. The pool is started on
+        first use and is not pickled, so the owner can be sent to other processes (which start their own pool).
+    """
+    #
+    #----------------------------------------------------------------------------------------------
+    def __init__(self, cost_engine, n_workers=None, chunks_per_worker=4, min_batch_size=None):
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        if min_batch_size is None:
+            min_batch_size = 2 * n_workers
+
+        self._cost_engine       = cost_engine
+        self._n_workers         = n_workers
+        self._chunks_per_worker = chunks_per_worker
+        self._min_batch_size    = min_batch_size
+        self._executor          = None
+        self._finalizer         = None
+
+    #
+    #----------------------------------------------------------------------------------------------
+    @property
+    def executor(self):
+        if self._executor is None:
+            engine = self._cost_engine
+            arrays = {
+                "codes"     : np.asarray(engine.codes, dtype=np.uint8),
+                "bigrams"   : np.asarray(engine.bigrams)
+            }
+
+            blocks = []
+            tables = {}
+            for name, array in arrays.items():
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                blocks.append(block)
+                tables[name] = (block.name, array.shape, array.dtype.str)
+
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._n_workers,
+                initializer=_start_worker,
+                initargs=(engine.valid_keys, tables)
+            )
+            self._finalizer = weakref.finalize(self, _release, self._executor, blocks)
+
+        return self._executor
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def batch_cost(self, layouts):
+        """
+        Computes the cost of each row of a matrix of integer coded layouts in the worker processes (see
+        CostEngine.batch_cost)
+        """
+        layouts = np.asarray(layouts)
+        if self._n_workers <= 1 or len(layouts) < self._min_batch_size:
+            return self._cost_engine.batch_cost(layouts)
+
+        n_chunks = min(len(layouts), self._n_workers * self._chunks_per_worker)
+        costs = self.executor.map(_batch_cost, np.array_split(layouts, n_chunks))
+
+        return np.concatenate(list(costs))
+
+    def close(self):
+        """
+        Stops the worker processes and frees the shared memory
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+        self._executor = None
+        self._finalizer = None
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def __getstate__(self):
+        # the processes and the shared memory belong to this process
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_finalizer"] = None
+        return state
+
+    @property
+    def n_workers(self):
+        return self._n_workers
@@ -0,0 +1,126 @@
+import sqlite3
+
+
+class FitnessStore:
+    """
+        On-disk fitness store shared by processes (e.g. the joblib workers of a grid search) and by later runs.
+
+        Fitness values are kept in a SQLite file in WAL mode, so readers never block each other or the writer, keyed
+        by the integer coded layout and by a fingerprint of the corpus (see CostEngine.fingerprint). New values are
+        buffered and written in batches of batch_size. The connection is opened on first use and is not pickled, so
+        the store can be sent to other processes.
+    """
+    #
+    #----------------------------------------------------------------------------------------------
+    def __init__(self, path, fingerprint, batch_size=256, timeout=60):
+        self._path          = path
+        self._fingerprint   = fingerprint
+        self._batch_size    = batch_size
+        self._timeout       = timeout
+        self._connection    = None
+        self._pending       = {}
+        self.hits           = 0
+        self.misses         = 0
+
+    #
+    #----------------------------------------------------------------------------------------------
+    @property
+    def connection(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, timeout=self._timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS fitness ("
+                "fingerprint TEXT NOT NULL, layout BLOB NOT NULL, fitness REAL NOT NULL, "
+                "PRIMARY KEY (fingerprint, layout)) WITHOUT ROWID"
+            )
+            connection.commit()
+            self._connection = connection
+
+        return self._connection
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def get_many(self, keys):
+        """
+        Returns a dictionary with the stored fitness of the keys (layout bytes) found in the store
+        """
+        found = {key: self._pending[key] for key in keys if key in self._pending}
+        missing = list(set(keys) - set(found))
+
+        # SQLite limits the number of parameters of a query
+        for first in range(0, len(missing), 500):
+            batch = missing[first:first + 500]
+            rows = self.connection.execute(
+                "SELECT layout, fitness FROM fitness WHERE fingerprint = ? AND layout IN ({})".format(
+                    ", ".join("?" * len(batch))),
+                [self._fingerprint] + batch
+            )
+            found.update(rows)
+
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def put(self, key, value):
+        self._pending[key] = value
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered fitness values in one transaction
+        """
+        if not self._pending:
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO fitness (fingerprint, layout, fitness) VALUES (?, ?, ?)",
+                [(self._fingerprint, key, float(value)) for key, value in self._pending.items()]
+            )
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def __len__(self):
+        self.flush()
+        count, = self.connection.execute(
+            "SELECT COUNT(*) FROM fitness WHERE fingerprint = ?", (self._fingerprint,)).fetchone()
+        return count
+
+    def __getstate__(self):
+        # the connection belongs to this process; unsaved values are written before leaving it
+        self.flush()
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def fingerprint(self):
+        return self._fingerprint
+
+    @property
+    def stats(self):
+        return {
+            "Pending"   : len(self._pending),
+            "Hits"      : self.hits,
+            "Misses"    : self.misses
+        }
@@ -0,0 +1,81 @@
+class IndexedHeap:
+    """
+        Binary min-heap of the keys of the items 0, ..., N-1, with the position of each item in the heap, so the item
+        with the smallest key is read in O(1) and the key of any item is changed in O(log N)
+    """
+    #
+    #----------------------------------------------------------------------------------------------
+    def __init__(self, keys):
+        self._keys      = [float(key) for key in keys]
+        self._heap      = sorted(range(len(self._keys)), key=self._keys.__getitem__)  # a sorted list is a heap
+        self._position  = [0] * len(self._keys)
+        for position, item in enumerate(self._heap):
+            self._position[item] = position
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def top(self):
+        """
+        The item with the smallest key
+        """
+        return self._heap[0]
+
+    def key(self, item):
+        return self._keys[item]
+
+    def update(self, item, key):
+        """
+        Changes the key of the item, restoring the heap order
+        """
+        old_key = self._keys[item]
+        self._keys[item] = float(key)
+        if key < old_key:
+            self._sift_up(self._position[item])
+        else:
+            self._sift_down(self._position[item])
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def _sift_up(self, position):
+        heap, keys = self._heap, self._keys
+        item = heap[position]
+
+        while position > 0:
+            parent = (position - 1) // 2
+            if keys[heap[parent]] <= keys[item]:
+                break
+            self._move(heap[parent], position)
+            position = parent
+
+        self._move(item, position)
+
+    def _sift_down(self, position):
+        heap, keys = self._heap, self._keys
+        item = heap[position]
+        size = len(heap)
+
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and keys[heap[child + 1]] < keys[heap[child]]:
+                child += 1
+            if keys[item] <= keys[heap[child]]:
+                break
+            self._move(heap[child], position)
+            position = child
+
+        self._move(item, position)
+
+    def _move(self, item, position):
+        self._heap[position] = item
+        self._position[item] = position
+
+    #
+    #----------------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def keys(self):
+        return self._keys
@@ -16,6 +16,7 @@ class GeneticAlgorithmLogger:
         self._runs          = []
         self._generations   = []
         self._fitness       = []
+        self._stop_reason   = None
 
     #
     #----------------------------------------------------------------------------------------------    
@@ -24,6 +25,18 @@ class GeneticAlgorithmLogger:
         self._generations.append(generation)
         self._fitness.append(solution.fitness)  # adds the fittest solution of each generation
 
+    #
+    #----------------------------------------------------------------------------------------------
+    def set_stop_reason(self, reason):
+        """
+        Records why the run stopped (saved in the row of its last generation)
+        """
+        self._stop_reason = reason
+
+    @property
+    def stop_reason(self):
+        return self._stop_reason
+
     #
     #----------------------------------------------------------------------------------------------  
     def save(self):
@@ -43,6 +56,9 @@ class GeneticAlgorithmLogger:
             ), 
             columns =['Run', 'Generation', 'Fitness']
         )
+        df['Stop-Reason'] = ''
+        if len(df) > 0:
+            df.loc[len(df) - 1, 'Stop-Reason'] = self._stop_reason
 
         if not os.path.exists(final_log_dir):
             os.mkdir(final_log_dir)
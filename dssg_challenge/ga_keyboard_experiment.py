@@ -1,17 +1,18 @@
+from dssg_challenge.compile_corpus import load_corpus
 from dssg_challenge.ga.algorithm.genetic_algorithm import GeneticAlgorithm
 from dssg_challenge.ga.custom_problem.alskeyboard_problem import AlsKeyboardProblem
 
 from dssg_challenge.ga.algorithm.ga_operators import (
     initialize_using_random, initialize_using_heuristic, initialize_using_hc, initialize_using_greedy, initialize_using_multiple,
-    roulettewheel_selection, rank_selection, tournament_selection,
+    roulettewheel_selection, rank_selection, tournament_selection, stochastic_universal_sampling, truncation_selection,
     cycle_crossover, pmx_crossover, order1_crossover, heuristic_crossover, multiple_crossover,
     swap_mutation, insert_mutation, inversion_mutation, scramble_mutation, greedy_mutation, multiple_mutation,
     elitism_replacement, standard_replacement
 )
 
 from dssg_challenge.ga.util.observer import LocalSearchObserver
-from copy import deepcopy
 
+from itertools import zip_longest
 from os import listdir, path, mkdir
 from os.path import isfile, join, splitext
 from pandas import pandas as pd
@@ -21,26 +22,27 @@ from joblib import Parallel, delayed
 # Problem
 # -----------------------------------------------------------------------------
 # Decision Variables
-with open(join(".", "data", "processed", "en-corpus.txt")) as file:
-    en_corpus = file.read()[:-1]  # get rid of "\n"
-
 with open(join(".", "data", "processed", "en-keys.txt")) as file:
     en_keys = file.read()[:-1]  # get rid of "\n"
 
+# memory-mapped integer corpus, compiled next to the text file on first use
+en_corpus, en_tables = load_corpus(join(".", "data", "processed", "en-corpus.txt"), en_keys)
+
 en_key_decision_variables = {
     "Corpus": en_corpus,
-    "Valid_keys": en_keys
+    "Valid_keys": en_keys,
+    "Bigrams": en_tables["bigrams"]
 }
 
-with open(join(".", "data", "processed", "pt-corpus.txt")) as file:
-    pt_corpus = file.read()[:-1]  # get rid of "\n"
-
 with open(join(".", "data", "processed", "pt-keys.txt")) as file:
     pt_keys = file.read()[:-1]  # get rid of "\n"
 
+pt_corpus, pt_tables = load_corpus(join(".", "data", "processed", "pt-corpus.txt"), pt_keys)
+
 pt_key_decision_variables = {
     "Corpus": pt_corpus,
-    "Valid_keys": pt_keys
+    "Valid_keys": pt_keys,
+    "Bigrams": pt_tables["bigrams"]
 }
 
 # Problem Instance
@@ -51,6 +53,11 @@ pt_alskeyboard_problem_instance = AlsKeyboardProblem(
     decision_variables=pt_key_decision_variables
 )
 
+# exact costs shared on disk by all the workers and by later runs of the grid search
+fitness_store_path = join(".", "data", "fitness.sqlite")
+en_alskeyboard_problem_instance.set_fitness_store(fitness_store_path)
+pt_alskeyboard_problem_instance.set_fitness_store(fitness_store_path)
+
 
 def one_combination(problem_instance, params, param_labels, sample_size=30,
                     log_run_dir=join(".", "data", "log_run"), log_all_dir=join(".", "data", "log_all") ):
@@ -93,13 +100,15 @@ def one_combination(problem_instance, params, param_labels, sample_size=30,
         ga.register_observer(ga_observer)
         ga.search()
         ga.save_log()
+        if problem_instance.fitness_store is not None:
+            problem_instance.fitness_store.flush()
 
         # find the best solution over the runs
         if run == 1:
-            overall_best_solution = deepcopy(ga.best_solution)
+            overall_best_solution = ga.best_solution.clone()
         else:
             if ga.best_solution.fitness < overall_best_solution.fitness:
-                overall_best_solution = deepcopy(ga.best_solution)
+                overall_best_solution = ga.best_solution.clone()
 
         print('overall_best_solution: ', overall_best_solution.representation)
         print('overall_best_solution fitness: ', overall_best_solution.fitness)
@@ -113,6 +122,8 @@ def one_combination(problem_instance, params, param_labels, sample_size=30,
     counter = 0
     generations = []
 
+    stop_reasons = []
+
     # Going to each run for a given parameter configuration and extracting fitness for each generation
     for file_name in log_files:
         if file_name.startswith('run_'):
@@ -120,10 +131,13 @@ def one_combination(problem_instance, params, param_labels, sample_size=30,
             fitness_runs.append(list(df["Fitness"]))
             columns_name.append(splitext(file_name)[0])
             counter += 1
-            if not generations:
+            if len(df["Generation"]) > len(generations):
                 generations = list(df["Generation"])
+            if "Stop-Reason" in df:
+                stop_reasons.append([splitext(file_name)[0], df["Generation"].iloc[-1], df["Stop-Reason"].iloc[-1]])
 
-    df = pd.DataFrame(list(zip(*fitness_runs)), columns=columns_name)
+    # runs stopped early (see the stop criteria of GeneticAlgorithm) keep the fitness of their last generation
+    df = pd.DataFrame(list(zip_longest(*fitness_runs)), columns=columns_name).ffill()
     fitness_std = list(df.std(axis=1))
     fitness_mean = list(df.mean(axis=1))
 
@@ -138,6 +152,8 @@ def one_combination(problem_instance, params, param_labels, sample_size=30,
         df.to_excel(writer, sheet_name='Fitness', index=False, encoding='utf-8')
         pd.DataFrame([[overall_best_solution.representation, overall_best_solution.fitness]], columns=["Representation", "Fitness"]).\
             to_excel(writer, sheet_name='Overall_Best_Solution', index=False)
+        pd.DataFrame(stop_reasons, columns=["Run", "Generations", "Stop-Reason"]).\
+            to_excel(writer, sheet_name='Stop_Reasons', index=False)
 
 # Parameter Configuration
 #--------------------------------------------------------------------------------------------------
@@ -207,6 +223,8 @@ param_labels = {
     roulettewheel_selection: "rol",
     tournament_selection: "tourn",
     rank_selection: "rank",
+    stochastic_universal_sampling: "sus",
+    truncation_selection: "trunc",
     cycle_crossover: "cycle",
     pmx_crossover: "pmx",
     order1_crossover: "order1",
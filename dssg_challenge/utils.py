@@ -2,6 +2,8 @@
 Auxiliary functions for the ALS keyboard challenge
 """
 
+from functools import lru_cache
+
 import numpy as np
 
 
@@ -14,13 +16,15 @@ def check_keyboard(keyboard, valid_chars, size=37):
     assert all([x in keyboard for x in valid_chars]), "character in valid_chars not in keyboard"
 
 
-def compute_cell_location():
+def compute_cell_location(size=37):
     """Compute the location of each key in the hexagonal keyboard
     """
 
-    ring_id = np.asarray([0, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
-                          2, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3,
-                          3])
+    # the central cell, then rings of 6, 12, 18, ... cells around it
+    ring_id = [0]
+    while len(ring_id) < size:
+        ring_id += [ring_id[-1] + 1] * (6 * (ring_id[-1] + 1))
+    ring_id = np.asarray(ring_id[:size])
 
     n_cells = len(ring_id)
     n_rings = max(ring_id) + 1
@@ -52,3 +56,74 @@ def compute_cell_location():
                    pos[1] - cos_dir[current_dir])
             remaining_in_edge -= 1
     return coords
+
+
+@lru_cache(maxsize=None)
+def compute_distance_matrix(size=37):
+    """Compute the (read-only) matrix with the euclidean distance between
+    each pair of keys, cached for each keyboard size
+    """
+
+    coords = compute_cell_location(size)
+    dist = np.sqrt(((coords[:, None] - coords[None]) ** 2).sum(axis=-1))
+    dist.flags.writeable = False
+
+    return dist
+
+
+@lru_cache(maxsize=None)
+def compute_symmetries(size=37):
+    """Compute the (read-only) cell permutations of the 12 symmetries of the
+    hexagonal keyboard (6 rotations around the central cell, with and without
+    a reflection), which leave the distance matrix unchanged.
+
+    Row ``g`` maps each cell to the cell it is moved to by symmetry ``g``
+    (row 0 is the identity). Only full rings are symmetric, so the keyboard
+    size must be 1 + 6 + 12 + ... cells.
+    """
+
+    coords = compute_cell_location(size)
+    perms = []
+    for reflect in (1, -1):
+        for rotation in range(6):
+            angle = rotation * np.pi / 3
+            rot = np.array([[np.cos(angle), -np.sin(angle)],
+                            [np.sin(angle), np.cos(angle)]])
+            moved = (coords * [reflect, 1]) @ rot.T
+
+            dist = ((moved[:, None] - coords[None]) ** 2).sum(axis=-1)
+            perm = dist.argmin(axis=1)
+            assert np.allclose(dist[np.arange(size), perm], 0), \
+                "Keyboard size without hexagonal symmetry"
+            perms.append(perm)
+
+    perms = np.array(perms)
+    perms.flags.writeable = False
+
+    return perms
+
+
+def canonicalize(layouts, size=37):
+    """Returns the canonical orientation of integer coded layouts (one per
+    row of a matrix, or a single layout): the lexicographically smallest of
+    its 12 symmetric copies, which all have the same cost
+    """
+
+    layouts = np.asarray(layouts)
+    single = layouts.ndim == 1
+    layouts = np.atleast_2d(layouts)
+
+    # copies[n, g, perm[g, c]] = layouts[n, c]
+    perms = compute_symmetries(size)
+    copies = np.empty((len(layouts),) + perms.shape, dtype=layouts.dtype)
+    copies[:, np.arange(len(perms))[:, None], perms] = layouts[:, None, :]
+
+    # keep the copies that are smallest in every cell so far
+    alive = np.ones(copies.shape[:2], dtype=bool)
+    for cell in range(size):
+        values = np.where(alive, copies[:, :, cell], np.iinfo(np.int64).max)
+        alive &= values == values.min(axis=1, keepdims=True)
+
+    canonical = copies[np.arange(len(layouts)), alive.argmax(axis=1)]
+
+    return canonical[0] if single else canonical